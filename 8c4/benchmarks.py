@@ -0,0 +1,245 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import time
+
+import game_simulator
+import hand_evaluation
+
+parser = argparse.ArgumentParser(description='Time the hand evaluators and payoff matrix builders.')
+parser.add_argument('--hands', type=int, default=20000,
+                    help='Hands per corpus')
+parser.add_argument('--seed', type=int, default=0, help='Random seed for the corpora')
+parser.add_argument('--deals', type=int, default=20,
+                    help='Deals for the payoff matrix benchmark (0 to skip)')
+parser.add_argument('--output', type=str, default=None,
+                    help='Save the evaluator results to this JSON file')
+parser.add_argument('--scaling-deals', type=int, default=20,
+                    help='Deals per game for the hand size scaling benchmark (0 to skip)')
+parser.add_argument('--compare', type=str, default=None,
+                    help='JSON file from an earlier run to compare against')
+parser.add_argument('--classify-mode', choices=hand_evaluation.CLASSIFY_MODES, default='direct',
+                    help='How classify_hand evaluates 5-card hands')
+
+# the original payoff matrix builder: split both hands into sets for every
+# cell and classify them from scratch.  kept as the baseline to beat.
+def naive_payoff_matrix(hand_A, hand_B):
+  hand_size = game_simulator.hand_size
+  payoff_matrix = []
+  for pass1 in itertools.combinations(range(hand_size), game_simulator.num_passed):
+    row = []
+    for pass2 in itertools.combinations(range(hand_size), game_simulator.num_passed):
+      new_hand_A = set()
+      new_hand_B = set()
+      for i in range(hand_size):
+        if i in pass1: new_hand_B.add(hand_A[i])
+        else:          new_hand_A.add(hand_A[i])
+        if i in pass2: new_hand_A.add(hand_B[i])
+        else:          new_hand_B.add(hand_B[i])
+      row.append(cmp(hand_evaluation.full_classify_hand(new_hand_A),
+                     hand_evaluation.full_classify_hand(new_hand_B)))
+    payoff_matrix.append(row)
+  return payoff_matrix
+
+def time_per_deal(payoff_function, deals):
+  start = time.time()
+  for (hand_A, hand_B) in deals:
+    payoff_function(hand_A, hand_B)
+  return (time.time() - start) / len(deals)
+
+def benchmark_payoff_matrix(num_deals = 20, seed = 0):
+  random.seed(seed)
+  deals = [game_simulator.generate_hands() for i in range(num_deals)]
+  builders = [('naive', naive_payoff_matrix),
+              ('get_payoff_matrix', game_simulator.get_payoff_matrix),
+              ('incremental', game_simulator.get_incremental_payoff_matrix)]
+  if game_simulator.np is not None:
+    builders.append(('get_payoff_array', lambda hand_A, hand_B:
+                     game_simulator.get_payoff_array(hand_A, hand_B).tolist()))
+
+  for (hand_A, hand_B) in deals[:3]:
+    expected = naive_payoff_matrix(hand_A, hand_B)
+    for (name, builder) in builders:
+      assert builder(hand_A, hand_B) == expected, '%s disagrees with naive' % (name,)
+
+  print 'Payoff matrix, %s deals:' % (num_deals,)
+  baseline = None
+  for (name, builder) in builders:
+    elapsed = time_per_deal(builder, deals)
+    baseline = baseline or elapsed
+    print '  %-20s %8.2f ms/deal  %6.1fx' % (name, elapsed * 1000, baseline / elapsed)
+
+def benchmark_deals(num_deals = 100000, seed = 0):
+  generators = [('old_generate_hands', game_simulator.old_generate_hands),
+                ('generate_hands', game_simulator.generate_hands),
+                ('deal_codes', game_simulator.deal_codes)]
+  print 'Deal generation, %s deals:' % (num_deals,)
+  for (name, generate) in generators:
+    rng = random.Random(seed)
+    start = time.time()
+    for i in xrange(num_deals):
+      generate(rng)
+    print '  %-20s %8.2f us/deal' % (name, (time.time() - start) / num_deals * 1e6)
+  if game_simulator.np is not None:
+    random_state = game_simulator.deal_random_state(seed, 0)
+    start = time.time()
+    game_simulator.deal_code_array(num_deals, random_state)
+    print '  %-20s %8.2f us/deal' % ('deal_code_array', (time.time() - start) / num_deals * 1e6)
+
+#####################
+# EVALUATORS
+#####################
+
+CORPUS_SIZES = [5, 7, 8]
+# calls are timed in groups this big, since single calls are too quick to time
+LATENCY_GROUP = 16
+
+def corpus(size, num_hands, seed):
+  rng = random.Random(seed * 100 + size)
+  deck = [(value, suit) for value in range(2, 15) for suit in hand_evaluation.SUITS]
+  return [rng.sample(deck, size) for i in range(num_hands)]
+
+def memo_available():
+  return os.path.exists(hand_evaluation.HANDS_MEMO_PATH)
+
+# name -> (function, how to prepare a hand for it, hand sizes it takes)
+def get_evaluators():
+  identity = lambda hand: hand
+  evaluators = {
+    'old_full_classify_hand': (hand_evaluation.old_full_classify_hand, identity, [5]),
+    'full_classify_hand': (hand_evaluation.full_classify_hand, identity, CORPUS_SIZES),
+    'old_best_poker_hand': (hand_evaluation.old_best_poker_hand, identity, CORPUS_SIZES),
+    'best_poker_hand': (hand_evaluation.best_poker_hand, identity, CORPUS_SIZES),
+    'best_five_mask': (hand_evaluation.best_five_mask, hand_evaluation.hand_to_mask, CORPUS_SIZES),
+    'classify_hand': (hand_evaluation.classify_hand, identity, CORPUS_SIZES),
+    'evaluate_mask': (hand_evaluation.evaluate_mask, hand_evaluation.hand_to_mask, CORPUS_SIZES),
+    'hand_rank': (hand_evaluation.hand_rank, identity, CORPUS_SIZES),
+  }
+  if memo_available():
+    evaluators['memo_classify_hand'] = (hand_evaluation.memo_classify_hand, identity, [5])
+    evaluators['memo_hand_rank'] = (hand_evaluation.memo_hand_rank, identity, [5])
+  return evaluators
+
+def percentile(sorted_values, fraction):
+  return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+# runs in a fresh worker process, so the memory high-water mark is its own:
+# the interpreter and the evaluator's tables, the corpus, and whatever the
+# evaluator allocates or maps in, e.g. the pages of the hands memo it reads
+def time_evaluator(args):
+  (name, size, num_hands, seed) = args
+  (evaluate, prepare, sizes) = get_evaluators()[name]
+  hands = [prepare(hand) for hand in corpus(size, num_hands, seed)]
+  latencies = []
+  start = time.time()
+  for i in range(0, len(hands), LATENCY_GROUP):
+    group = hands[i:i + LATENCY_GROUP]
+    group_start = time.time()
+    for hand in group:
+      evaluate(hand)
+    latencies.append((time.time() - group_start) / len(group))
+  elapsed = time.time() - start
+  latencies.sort()
+  return {
+    'hands_per_second': len(hands) / elapsed,
+    'p50_us': percentile(latencies, 0.5) * 1e6,
+    'p90_us': percentile(latencies, 0.9) * 1e6,
+    'p99_us': percentile(latencies, 0.99) * 1e6,
+    # ru_maxrss is in kilobytes on linux
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+  }
+
+# returns {evaluator: {hand size: measurements}}
+def benchmark_evaluators(num_hands = 20000, seed = 0):
+  results = {}
+  for (name, (evaluate, prepare, sizes)) in sorted(get_evaluators().items()):
+    results[name] = {}
+    for size in sizes:
+      pool = multiprocessing.Pool(1)
+      try:
+        results[name][str(size)] = pool.apply(time_evaluator, [(name, size, num_hands, seed)])
+      finally:
+        pool.terminate()
+  return results
+
+def print_evaluator_results(results, previous = None):
+  print 'Hand evaluators:'
+  print '  %-24s %4s %12s %9s %9s %9s %9s' % (
+    'evaluator', 'size', 'hands/s', 'p50 us', 'p90 us', 'p99 us', 'peak RSS KB')
+  for name in sorted(results):
+    for size in sorted(results[name], key = int):
+      result = results[name][size]
+      line = '  %-24s %4s %12.0f %9.2f %9.2f %9.2f %11d' % (
+        name, size, result['hands_per_second'], result['p50_us'], result['p90_us'],
+        result['p99_us'], result['peak_rss_kb'])
+      if previous and size in previous.get(name, {}):
+        line += '  %5.2fx' % (result['hands_per_second'] /
+                              previous[name][size]['hands_per_second'],)
+      print line
+
+#####################
+# SCALING
+#####################
+
+# (hand size, cards passed) of the two player games timed
+SCALING_GAMES = [(6, 3), (8, 4), (10, 5), (12, 6)]
+
+# runs in a fresh worker process, like time_evaluator, so the memory
+# high-water mark includes the game's pass tables and strength arrays
+def time_game(args):
+  import passing_game # needs numpy
+  (hand_size, num_passed, num_deals, seed) = args
+  game = passing_game.PassingGame(hand_size, num_passed)
+  rng = random.Random(seed)
+  deals = [game.deal(rng) for i in range(num_deals)]
+  start = time.time()
+  for hands in deals:
+    game.solve(hands)
+  elapsed = time.time() - start
+  return {
+    'deals_per_second': num_deals / elapsed,
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+  }
+
+def benchmark_scaling(num_deals = 20, seed = 0):
+  print 'Passing game, %s deals per size:' % (num_deals,)
+  print '  %4s %6s %8s %10s %10s %11s' % ('hand', 'passed', 'passes', 'cells', 'deals/s', 'peak RSS KB')
+  for (hand_size, num_passed) in SCALING_GAMES:
+    pool = multiprocessing.Pool(1)
+    try:
+      result = pool.apply(time_game, [(hand_size, num_passed, num_deals, seed)])
+    finally:
+      pool.terminate()
+    num_passes = game_simulator.choose(hand_size, num_passed)
+    print '  %4d %6d %8d %10d %10.1f %11d' % (
+      hand_size, num_passed, num_passes, num_passes ** 2, result['deals_per_second'],
+      result['peak_rss_kb'])
+
+def main():
+  args = parser.parse_args()
+  # the workers are forked, so they inherit the mode
+  hand_evaluation.set_classify_mode(args.classify_mode)
+  results = benchmark_evaluators(args.hands, args.seed)
+  previous = None
+  if args.compare:
+    with open(args.compare) as f:
+      previous = json.load(f)
+  print_evaluator_results(results, previous)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent = 2, sort_keys = True)
+  if args.deals:
+    print
+    benchmark_payoff_matrix(args.deals, args.seed)
+    print
+    benchmark_deals(seed = args.seed)
+  if args.scaling_deals and game_simulator.np is not None:
+    print
+    benchmark_scaling(args.scaling_deals, args.seed)
+
+if __name__ == '__main__':
+  main()
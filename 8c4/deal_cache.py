@@ -0,0 +1,58 @@
+import collections
+import cPickle as pickle
+import os
+
+import game_simulator
+import isomorphism
+
+# remembers find_winning_play outcomes by the canonical form of the deal, so a
+# deal that only differs from an earlier one by relabelling suits is free.
+# the least recently used entries are dropped once max_size is reached.  with
+# a path, the cache starts from whatever was saved there and save() writes it
+# back.
+class DealCache(object):
+  def __init__(self, max_size = 100000, path = None):
+    self.max_size = max_size
+    self.path = path
+    self.hits = 0
+    self.misses = 0
+    self.cells_evaluated = 0 # by the deals solved on a miss
+    self.outcomes = collections.OrderedDict()
+    if path is not None and os.path.exists(path):
+      with open(path, 'rb') as f:
+        for (key, outcome) in pickle.load(f):
+          self.store(key, outcome)
+
+  def __len__(self):
+    return len(self.outcomes)
+
+  def store(self, key, outcome):
+    self.outcomes.pop(key, None)
+    self.outcomes[key] = outcome
+    while len(self.outcomes) > self.max_size:
+      self.outcomes.popitem(last = False)
+
+  def lookup(self, key):
+    outcome = self.outcomes.pop(key, None)
+    if outcome is not None:
+      self.outcomes[key] = outcome
+    return outcome
+
+  # same as game_simulator.solve_deal
+  def solve(self, hand_A, hand_B):
+    key = isomorphism.canonical_hands(hand_A, hand_B)
+    outcome = self.lookup(key)
+    if outcome is not None:
+      self.hits += 1
+      return outcome
+    self.misses += 1
+    (outcome, handpass, num_cells) = game_simulator.solve_deal_with_pass(hand_A, hand_B)
+    self.cells_evaluated += num_cells
+    self.store(key, outcome)
+    return outcome
+
+  def save(self, path = None):
+    path = path or self.path
+    with open(path + '.tmp', 'wb') as f:
+      pickle.dump(list(self.outcomes.items()), f, pickle.HIGHEST_PROTOCOL)
+    os.rename(path + '.tmp', path)
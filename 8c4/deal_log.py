@@ -0,0 +1,126 @@
+import mmap
+import os
+import struct
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# a deal log holds one fixed-size record per simulated deal, after a header
+# naming the run's seed and batch size.  batch k of the run draws its deals
+# from monte_carlo.batch_rng(seed, k), so (batch, deal) says where a deal came
+# from.  the hands are stored as the masks of the deal's canonical form, and
+# the winning pass indexes all_passes over mask_to_hand of the winner's mask.
+#
+# records are only ever appended, and a writer keeps them in memory until it
+# has a buffer's worth, so the file sees a few large writes.
+
+MAGIC = '8c4deals'
+HEADER = struct.Struct('<8sIqI') # magic, record size, seed (signed), batch size
+RECORD = struct.Struct('<QIQQbhf')
+FIELDS = ('batch', 'deal', 'mask_A', 'mask_B', 'winner', 'winning_pass', 'seconds')
+NO_PASS = -1 # winning_pass of a deal nobody can force
+
+if np is not None:
+  RECORD_DTYPE = np.dtype([
+    ('batch', '<u8'), ('deal', '<u4'), ('mask_A', '<u8'), ('mask_B', '<u8'),
+    ('winner', 'i1'), ('winning_pass', '<i2'), ('seconds', '<f4')])
+  assert RECORD_DTYPE.itemsize == RECORD.size
+
+def read_header(f):
+  (magic, record_size, seed, batch_size) = HEADER.unpack(f.read(HEADER.size))
+  if magic != MAGIC or record_size != RECORD.size:
+    raise Exception('%s is not a deal log' % (f.name,))
+  return (seed, batch_size)
+
+def pack_records(records):
+  data = bytearray(len(records) * RECORD.size)
+  for (i, record) in enumerate(records):
+    RECORD.pack_into(data, i * RECORD.size, *record)
+  return str(data)
+
+class DealWriter(object):
+  # appends to the log at path, creating it if needed.  with num_records, any
+  # records past the first num_records are dropped first, e.g. ones written
+  # after the checkpoint a run is resuming from.  a log holding fewer records
+  # than that is an error, since the missing deals cannot be made up.
+  def __init__(self, path, seed, batch_size, num_records = None, buffer_size = 1 << 20):
+    self.path = path
+    self.buffer_size = buffer_size
+    self.pending = []
+    self.pending_size = 0
+    if not os.path.exists(path):
+      with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, RECORD.size, seed, batch_size))
+    self.f = open(path, 'r+b')
+    if read_header(self.f) != (seed, batch_size):
+      self.f.close()
+      raise Exception('deal log %s was made with a different seed or batch size' % (path,))
+    if num_records is not None:
+      found = (os.fstat(self.f.fileno()).st_size - HEADER.size) // RECORD.size
+      if found < num_records:
+        self.f.close()
+        raise Exception('deal log %s holds %d deals, expected at least %d' % (
+          path, found, num_records))
+      self.f.truncate(HEADER.size + num_records * RECORD.size)
+    self.f.seek(0, os.SEEK_END)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def write(self, batch, deal, mask_A, mask_B, winner, winning_pass, seconds):
+    self.write_packed(RECORD.pack(batch, deal, mask_A, mask_B, winner, winning_pass, seconds))
+
+  # writes records already packed with pack_records
+  def write_packed(self, data):
+    self.pending.append(data)
+    self.pending_size += len(data)
+    if self.pending_size >= self.buffer_size:
+      self.flush()
+
+  # with sync, waits until the records are on disk, e.g. before a checkpoint
+  # counts them
+  def flush(self, sync = False):
+    self.f.write(''.join(self.pending))
+    self.f.flush()
+    if sync:
+      os.fsync(self.f.fileno())
+    self.pending = []
+    self.pending_size = 0
+
+  def close(self):
+    if not self.f.closed:
+      self.flush(sync = True)
+      self.f.close()
+
+def num_records(path):
+  return (os.path.getsize(path) - HEADER.size) // RECORD.size
+
+# (seed, batch size, records) of a log, with the records memory-mapped as a
+# numpy structured array with the fields in FIELDS
+def read_deals(path):
+  with open(path, 'rb') as f:
+    (seed, batch_size) = read_header(f)
+  if not num_records(path):
+    return (seed, batch_size, np.zeros(0, dtype=RECORD_DTYPE))
+  records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size,
+                      shape=(num_records(path),))
+  return (seed, batch_size, records)
+
+# the records of a log as tuples of the fields in FIELDS, without numpy
+def iter_deals(path):
+  with open(path, 'rb') as f:
+    read_header(f)
+    count = num_records(path)
+    if not count:
+      return
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      for i in xrange(count):
+        yield RECORD.unpack_from(data, HEADER.size + i * RECORD.size)
+    finally:
+      data.close()
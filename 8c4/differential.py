@@ -0,0 +1,214 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import time
+
+import game_simulator
+import hand_evaluation
+
+parser = argparse.ArgumentParser(
+  description='Check that the hand evaluators order hands consistently.')
+parser.add_argument('--sizes', type=int, nargs='+', default=[5, 7, 8],
+                    help='Hand sizes to check (5 is exhaustive, others sampled)')
+parser.add_argument('--samples', type=int, default=50000,
+                    help='Sampled hands per size above 5')
+parser.add_argument('--seed', type=int, default=0, help='Random seed for the samples')
+parser.add_argument('--processes', type=int, default=None,
+                    help='Worker processes (defaults to one per core)')
+parser.add_argument('--best-five-ranks', type=int, nargs='*', default=range(10, 15),
+                    help='Check best_five against old_best_poker_hand on every 5-8 card '
+                         'hand from these ranks (none to skip)')
+
+# every engine maps a hand of card tuples to a value, and values of the same
+# engine compare like the hands do.  full_classify_hand is the reference the
+# others are checked against.
+REFERENCE = 'full_classify_hand'
+
+def old_pipeline(hand):
+  return hand_evaluation.old_full_classify_hand(hand_evaluation.old_best_poker_hand(hand))
+
+# name -> (function, hand sizes it takes)
+def get_engines():
+  engines = {
+    'full_classify_hand': (hand_evaluation.full_classify_hand, None),
+    'old_full_classify_hand': (hand_evaluation.old_full_classify_hand, [5]),
+    'old_best_poker_hand+old_full_classify_hand': (old_pipeline, None),
+    'classify_hand': (hand_evaluation.classify_hand, None),
+    'hand_rank': (hand_evaluation.hand_rank, None),
+    'best_five': (lambda hand: hand_evaluation.best_five(hand)[0], None),
+  }
+  if os.path.exists(hand_evaluation.HANDS_MEMO_PATH):
+    engines['memo_classify_hand'] = (hand_evaluation.memo_classify_hand, [5])
+    engines['memo_hand_rank'] = (hand_evaluation.memo_hand_rank, [5])
+  return engines
+
+def engines_for_size(size):
+  return sorted(name for (name, (evaluate, sizes)) in get_engines().items()
+                if sizes is None or size in sizes)
+
+# all 5-card hands whose lowest card is the given one
+def exhaustive_shard(lowest):
+  for rest in itertools.combinations(range(lowest + 1, 52), 4):
+    yield [hand_evaluation.decode_card(code) for code in (lowest,) + rest]
+
+def sampled_shard(size, seed, chunk, num_hands):
+  rng = random.Random((seed * 100 + size) * 2**32 + chunk)
+  deck = [hand_evaluation.decode_card(code) for code in range(52)]
+  for i in range(num_hands):
+    yield rng.sample(deck, size)
+
+# evaluates a shard with every engine.  for each engine returns the time it
+# took and, for each distinct (reference value, engine value) pair, one hand
+# that produced it.
+def check_shard(args):
+  (size, shard) = args
+  if size == 5:
+    hands = list(exhaustive_shard(shard))
+  else:
+    hands = list(sampled_shard(size, *shard))
+  engines = get_engines()
+  reference = [engines[REFERENCE][0](hand) for hand in hands]
+  results = {}
+  for name in engines_for_size(size):
+    evaluate = engines[name][0]
+    start = time.time()
+    values = [evaluate(hand) for hand in hands]
+    elapsed = time.time() - start
+    pairs = {}
+    for (hand, reference_value, value) in zip(hands, reference, values):
+      pairs.setdefault((reference_value, value), hand)
+    results[name] = (elapsed, pairs)
+  return (len(hands), results)
+
+# compares an engine's ordering to the reference's, from the distinct
+# (reference value, engine value) pairs.  returns (contradiction, merged,
+# split): a pair of hands the two order oppositely (or None), how many
+# adjacent reference classes the engine ties, and how many reference classes
+# the engine tells apart.
+def compare_orderings(pairs):
+  by_reference = {}
+  for (reference_value, value) in pairs:
+    by_reference.setdefault(reference_value, []).append(value)
+  contradiction = None
+  merged = 0
+  split = 0
+  highest = None # (value, reference value) with the highest engine value so far
+  for reference_value in sorted(by_reference):
+    values = sorted(by_reference[reference_value])
+    if len(values) > 1:
+      split += 1
+    if highest is not None:
+      if highest[0] > values[0] and contradiction is None:
+        contradiction = (pairs[(highest[1], highest[0])],
+                         pairs[(reference_value, values[0])])
+      elif highest[0] == values[0]:
+        merged += 1
+    if highest is None or values[-1] > highest[0]:
+      highest = (values[-1], reference_value)
+  return (contradiction, merged, split)
+
+def check_size(size, pool, processes, num_samples, seed):
+  if size == 5:
+    shards = [(size, lowest) for lowest in range(48)]
+  else:
+    chunk = max(1, num_samples // (4 * processes))
+    shards = [(size, (seed, i, min(chunk, num_samples - i * chunk)))
+              for i in range((num_samples + chunk - 1) // chunk)]
+  total_hands = 0
+  seconds = {}
+  pairs = {}
+  for (num_hands, results) in pool.imap_unordered(check_shard, shards):
+    total_hands += num_hands
+    for (name, (elapsed, shard_pairs)) in results.items():
+      seconds[name] = seconds.get(name, 0) + elapsed
+      for (key, hand) in shard_pairs.items():
+        pairs.setdefault(name, {}).setdefault(key, hand)
+
+  print '%d-card hands: %d %s' % (size, total_hands, 'exhaustive' if size == 5 else 'sampled')
+  ok = True
+  for name in sorted(pairs):
+    (contradiction, merged, split) = compare_orderings(pairs[name])
+    if contradiction is not None:
+      ok = False
+      status = 'CONTRADICTS %s on %s vs %s' % (
+        REFERENCE, [game_simulator.card_to_string(card) for card in contradiction[0]],
+        [game_simulator.card_to_string(card) for card in contradiction[1]])
+    elif merged or split:
+      status = 'consistent (ties %d adjacent classes, splits %d)' % (merged, split)
+    else:
+      status = 'identical order'
+    print '  %-40s %10.0f hands/s  %s' % (name, total_hands / seconds[name], status)
+  return ok
+
+#####################
+# BEST FIVE
+#####################
+
+BEST_FIVE_SIZES = [5, 6, 7, 8]
+
+# checks best_five on every hand of the given size from the ranks whose first
+# card is deck[first]: its five must come from the hand and have the hand's
+# strength, and old_best_poker_hand's scan must rank them level with its own
+# pick.  the scan's classifier ties trips with different kickers, so its pick
+# may be weaker there.  returns (hands checked, hands where the scan picked
+# weaker cards, a hand that failed or None).
+def check_best_five_shard(args):
+  (ranks, size, first) = args
+  deck = [card for card in hand_evaluation.CODE_TO_CARD if card[0] in ranks]
+  num_hands = 0
+  num_weaker = 0
+  for rest in itertools.combinations(deck[first + 1:], size - 1):
+    hand = (deck[first],) + rest
+    (strength, five) = hand_evaluation.best_five(hand)
+    scanned = hand_evaluation.old_best_poker_hand(hand)
+    scanned_strength = hand_evaluation.hand_strength(scanned)
+    if (len(five) != 5 or not set(five) <= set(hand) or
+        hand_evaluation.hand_strength(five) != strength or
+        hand_evaluation.hand_strength(hand) != strength or
+        hand_evaluation.old_compare_poker_hand(five, scanned) != 0 or
+        scanned_strength > strength):
+      return (num_hands, num_weaker, hand)
+    num_hands += 1
+    num_weaker += scanned_strength < strength
+  return (num_hands, num_weaker, None)
+
+def check_best_five(pool, ranks):
+  deck_size = 4 * len(ranks)
+  shards = [(ranks, size, first) for size in BEST_FIVE_SIZES
+            for first in range(deck_size - size + 1)]
+  total_hands = 0
+  total_weaker = 0
+  failed = None
+  start = time.time()
+  for (num_hands, num_weaker, hand) in pool.imap_unordered(check_best_five_shard, shards):
+    total_hands += num_hands
+    total_weaker += num_weaker
+    failed = failed or hand
+  print 'best_five on every %s-card hand from ranks %s: %d hands (%.1fs)' % (
+    '/'.join(map(str, BEST_FIVE_SIZES)), ranks, total_hands, time.time() - start)
+  if failed is not None:
+    print '  DISAGREES with old_best_poker_hand on %s' % (
+      [game_simulator.card_to_string(card) for card in failed],)
+    return False
+  print '  agrees with old_best_poker_hand (whose pick is weaker in %d hands)' % (total_weaker,)
+  return True
+
+def main():
+  args = parser.parse_args()
+  processes = args.processes or multiprocessing.cpu_count()
+  pool = multiprocessing.Pool(processes)
+  ok = True
+  try:
+    for size in args.sizes:
+      ok = check_size(size, pool, processes, args.samples, args.seed) and ok
+    if args.best_five_ranks:
+      ok = check_best_five(pool, sorted(set(args.best_five_ranks))) and ok
+  finally:
+    pool.terminate()
+  if not ok:
+    raise SystemExit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,144 @@
+import argparse
+import fractions
+import itertools
+import multiprocessing
+import time
+
+import game_simulator
+import hand_evaluation
+import isomorphism
+
+parser = argparse.ArgumentParser(
+  description='Count exactly how many deals of 8-choose-4 have a forced win.')
+parser.add_argument('--ranks', type=int, nargs='+', default=range(2, 15),
+                    help='Only deal cards of these ranks (2-14)')
+parser.add_argument('--processes', type=int, default=None,
+                    help='Worker processes (defaults to one per core)')
+parser.add_argument('--shards', type=int, default=None,
+                    help='Units of work (defaults to 8 per process)')
+
+# only one deal per class is visited: the canonical form, whose suit blocks
+# are already sorted, generated block by block and weighted by the size of its
+# class.  swapping the players maps classes onto classes, so of a class and
+# its swapped twin only the smaller canonical form is solved, and the twin's
+# outcome is read off the transposed payoff matrix.
+#
+# with the full deck this is ~2.8e15 distinct classes, far beyond reach; it is
+# practical on a reduced deck, e.g. --ranks 11 12 13 14.
+
+def deck_codes(ranks):
+  return [code for code in range(52) if hand_evaluation.decode_card(code)[0] in ranks]
+
+def num_deals(ranks):
+  deck_size = len(deck_codes(ranks))
+  hand_size = game_simulator.hand_size
+  return choose(deck_size, hand_size) * choose(deck_size - hand_size, hand_size)
+
+choose = game_simulator.choose
+
+# the canonical forms of every deal from the given ranks: tuples of suit
+# blocks (ranks A holds, ranks B holds), each block no greater than the one
+# before.  the forms are split into shards by their first two blocks, so a
+# shard skips the others' forms without generating them.
+def canonical_forms(ranks, shard = 0, num_shards = 1):
+  ranks_mask = sum(1 << (rank - 2) for rank in set(ranks))
+  # every subset of the ranks, largest first
+  subsets = [subset for subset in xrange(ranks_mask, -1, -1) if not subset & ~ranks_mask]
+  bit_count = hand_evaluation.BIT_COUNT
+  num_suits = len(hand_evaluation.SUITS)
+  num_ranks = bit_count[ranks_mask]
+  prefixes = itertools.count()
+
+  def forms(suit, left_A, left_B, previous):
+    if suit == num_suits:
+      if left_A == left_B == 0:
+        yield ()
+      return
+    # the suits after this one must have room for the cards still to place
+    room = (num_suits - suit - 1) * num_ranks
+    for ranks_A in subsets:
+      if ranks_A > previous[0] or bit_count[ranks_A] > left_A:
+        continue
+      for ranks_B in subsets:
+        if ranks_B & ranks_A or bit_count[ranks_B] > left_B:
+          continue
+        block = (ranks_A, ranks_B)
+        if block > previous:
+          continue
+        placed = bit_count[ranks_A] + bit_count[ranks_B]
+        if left_A + left_B - placed > room:
+          continue
+        if suit == 1 and next(prefixes) % num_shards != shard:
+          continue
+        for rest in forms(suit + 1, left_A - bit_count[ranks_A], left_B - bit_count[ranks_B], block):
+          yield (block,) + rest
+
+  hand_size = game_simulator.hand_size
+  return forms(0, hand_size, hand_size, (ranks_mask, ranks_mask))
+
+# the canonical form of the deal with the players swapped
+def swap_form(canonical):
+  return tuple(sorted(((ranks_B, ranks_A) for (ranks_A, ranks_B) in canonical), reverse = True))
+
+# yields (canonical form, whether swapping players stays in the class) for
+# each class to solve in the given shard
+def canonical_classes(ranks, shard = 0, num_shards = 1):
+  for canonical in canonical_forms(ranks, shard, num_shards):
+    swapped = swap_form(canonical)
+    if swapped < canonical:
+      continue
+    yield (canonical, swapped == canonical)
+
+def solve_class(canonical, swap_in_class, tally):
+  (mask_A, mask_B) = isomorphism.deal_masks(canonical)
+  hand_A = hand_evaluation.mask_to_hand(mask_A)
+  hand_B = hand_evaluation.mask_to_hand(mask_B)
+  payoff_matrix = game_simulator.build_payoff_matrix(hand_A, hand_B)
+  size = isomorphism.class_size(canonical)
+  tally[game_simulator.find_winning_play(hand_A, hand_B, payoff_matrix)] += size
+  if not swap_in_class:
+    swapped_matrix = game_simulator.swap_players(payoff_matrix)
+    tally[game_simulator.find_winning_play(hand_B, hand_A, swapped_matrix)] += size
+
+def enumerate_shard(args):
+  (ranks, shard, num_shards) = args
+  tally = {1: 0, 0: 0, -1: 0}
+  num_classes = 0
+  for (canonical, swap_in_class) in canonical_classes(ranks, shard, num_shards):
+    solve_class(canonical, swap_in_class, tally)
+    num_classes += 1
+  return (tally, num_classes)
+
+# returns the tally of outcomes over every ordered deal from the given ranks
+def enumerate_deals(ranks, processes = None, num_shards = None, verbose = True):
+  processes = processes or multiprocessing.cpu_count()
+  num_shards = num_shards or 8 * processes
+  pool = multiprocessing.Pool(processes)
+  tally = {1: 0, 0: 0, -1: 0}
+  num_classes = 0
+  start = time.time()
+  try:
+    shards = [(ranks, shard, num_shards) for shard in range(num_shards)]
+    for (shard_tally, shard_classes) in pool.imap_unordered(enumerate_shard, shards):
+      for winner in shard_tally:
+        tally[winner] += shard_tally[winner]
+      num_classes += shard_classes
+      if verbose:
+        print '%d classes solved (%.1fs)' % (num_classes, time.time() - start)
+  finally:
+    pool.terminate()
+  assert sum(tally.values()) == num_deals(ranks)
+  return tally
+
+def main():
+  args = parser.parse_args()
+  ranks = sorted(set(args.ranks))
+  print 'Enumerating %d deals from ranks %s...' % (num_deals(ranks), ranks)
+  tally = enumerate_deals(ranks, args.processes, args.shards)
+  total = sum(tally.values())
+  fraction = fractions.Fraction(tally[1] + tally[-1], total)
+  print tally
+  print 'forced win fraction %s = %.6f' % (fraction, float(fraction))
+
+if __name__ == '__main__':
+  main()
@@ -1,8 +1,12 @@
 import random
 import copy
-import time
+import math
 import hand_evaluation
-import itertools
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 # card representation is (card_number, card_suit), where
 #
@@ -68,21 +72,23 @@ def card_to_string(card):
 hand_size =  8
 num_passed = 4
 
-def get_random(array):
-  return array[random.randrange(len(array))]
+def get_random(array, rng = random):
+  return array[rng.randrange(len(array))]
 
-def get_random_card():
-  return (get_random(card_numbers), get_random(card_suits))
+def get_random_card(rng = random):
+  return (get_random(card_numbers, rng), get_random(card_suits, rng))
 
-def generate_hands():
+# the original deal generator: draws random cards until it has 16 distinct
+# ones.  kept for comparison.
+def old_generate_hands(rng = random):
   cards_set = set(); # set of 16 cards
   hands = []; # 2 by hand_size array of cards
 
   hand = []
   for i in range(2 * hand_size):
-    card = get_random_card()
+    card = get_random_card(rng)
     while card in cards_set:
-      card = get_random_card()
+      card = get_random_card(rng)
     cards_set.add(card)
 
     hand.append(card)
@@ -92,35 +98,232 @@ def generate_hands():
 
   return (hands[0], hands[1])
 
+DECK = range(52)
+
+# num_hands hands of size card codes, drawn by a fisher-yates shuffle of the
+# deck that stops as soon as the cards needed are in place
+def deal_codes(rng = random, num_hands = 2, size = hand_size):
+  deck = DECK[:]
+  random_float = rng.random
+  for i in xrange(num_hands * size):
+    j = i + int(random_float() * (52 - i))
+    (deck[i], deck[j]) = (deck[j], deck[i])
+  return [deck[start:start + size] for start in xrange(0, num_hands * size, size)]
+
+def generate_hands(rng = random):
+  (codes_A, codes_B) = deal_codes(rng)
+  code_to_card = hand_evaluation.CODE_TO_CARD
+  return ([code_to_card[code] for code in codes_A], [code_to_card[code] for code in codes_B])
+
+# the same shuffle for many deals at once: a (num_deals, num_hands * size)
+# array whose rows are the deals' card codes, hand after hand.  random_state
+# is a numpy RandomState, e.g. from deal_random_state.  only the benchmarks
+# use it: the simulator deals from batch_rng, whose streams fix its tallies.
+def deal_code_array(num_deals, random_state, num_hands = 2, size = hand_size):
+  num_cards = num_hands * size
+  decks = np.tile(np.arange(52, dtype=np.int64), (num_deals, 1))
+  rows = np.arange(num_deals)
+  for i in xrange(num_cards):
+    j = i + (random_state.random_sample(num_deals) * (52 - i)).astype(np.int64)
+    drawn = decks[rows, j]
+    decks[rows, j] = decks[:, i]
+    decks[:, i] = drawn
+  return decks[:, :num_cards]
+
+# an independent, reproducible numpy stream for each (seed, stream) pair, e.g.
+# one per worker or per batch.  negative numbers go in as their 64-bit two's
+# complement, since RandomState only takes 32-bit words.
+def deal_random_state(seed, stream):
+  return np.random.RandomState([seed & 0xffffffff, (seed >> 32) & 0xffffffff,
+                                stream & 0xffffffff, (stream >> 32) & 0xffffffff])
+
+def choose(n, k):
+  if k < 0 or k > n:
+    return 0
+  return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+# the position of a sorted k-subset of range(n) in lexicographic order (the
+# order of itertools.combinations).  mirroring every x to n - 1 - x reverses
+# that order into colex order, whose positions the combinatorial number
+# system gives directly.
+def combination_rank(combination, n, k):
+  return choose(n, k) - 1 - sum(choose(n - 1 - x, k - i) for (i, x) in enumerate(combination))
+
+# the k-subset of range(n) at the given lexicographic position
+def combination_at(rank, n, k):
+  combination = []
+  x = 0
+  for i in range(k):
+    # skip past the subsets that have x at this position
+    while choose(n - 1 - x, k - 1 - i) <= rank:
+      rank -= choose(n - 1 - x, k - 1 - i)
+      x += 1
+    combination.append(x)
+    x += 1
+  return tuple(combination)
+
+# the ways to give away num_passed cards of a hand_size-card hand, as tuples
+# of positions in the hand, in lexicographic order.  payoff matrices, strategy
+# reports and saved results all number passes this way.
+def get_passes(hand_size, num_passed):
+  return [combination_at(i, hand_size, num_passed) for i in range(choose(hand_size, num_passed))]
+
+# when a pass is half the hand, complement_passes[i] is the pass giving away
+# exactly the cards the i-th pass keeps, else None
+def get_complement_passes(passes, hand_size):
+  if 2 * len(passes[0]) != hand_size:
+    return None
+  index = {handpass: i for (i, handpass) in enumerate(passes)}
+  return [index[tuple(i for i in range(hand_size) if i not in handpass)] for handpass in passes]
+
+# row i is 1 at the positions given away by the i-th pass
+def get_pass_masks(passes, hand_size):
+  return np.array([[i in handpass for i in range(hand_size)] for handpass in passes],
+                  dtype=np.int64)
+
+# the passes of the 8-choose-4 game: all_passes[i] is the i-th pass and
+# pass_index[handpass] is i
+all_passes = get_passes(hand_size, num_passed)
+pass_index = {handpass: i for (i, handpass) in enumerate(all_passes)}
+
+# the k-subsets of range(n) in revolving door order: each differs from the
+# one before by one element leaving and one joining.  built as the order for
+# range(n - 1), followed by the order of its (k - 1)-subsets backwards with
+# n - 1 added to each.
+def revolving_door(n, k):
+  if k == 0 or k == n:
+    yield tuple(range(k))
+    return
+  for subset in revolving_door(n - 1, k):
+    yield subset
+  for subset in reversed(list(revolving_door(n - 1, k - 1))):
+    yield subset + (n - 1,)
+
+# the passes in revolving door order, and the index of each in all_passes
+gray_passes = list(revolving_door(hand_size, num_passed))
+gray_order = [pass_index[handpass] for handpass in gray_passes]
+
+# B's hand after passes (i, j) is A's hand after (complement_passes[i],
+# complement_passes[j]), so each post-pass hand of a deal only needs
+# evaluating once
+complement_passes = get_complement_passes(all_passes, hand_size)
+
+# masks of the cards kept and of the cards passed, for every pass
+def get_half_hands(hand, passes = all_passes):
+  bits = [hand_evaluation.CARD_TO_BIT[card] for card in hand]
+  whole = sum(bits)
+  passed = [sum(bits[i] for i in handpass) for handpass in passes]
+  kept = [whole ^ half for half in passed]
+  return (kept, passed)
+
+# the same as numpy arrays, from the hand's card bits and get_pass_masks
+def get_half_hand_arrays(bits, pass_masks):
+  passed = pass_masks.dot(bits)
+  return (bits.sum() ^ passed, passed)
+
+# strengths[i][j] is the strength of kept[i] combined with received[j]
+def get_strength_matrix(kept, received):
+  evaluate_mask = hand_evaluation.evaluate_mask
+  return [[evaluate_mask(half | other) for other in received] for half in kept]
+
+# (positions leaving, positions joining) the pass at each step of passes
+def get_pass_deltas(passes):
+  return [(sorted(set(previous) - set(current)), sorted(set(current) - set(previous)))
+          for (previous, current) in zip(passes, passes[1:])]
+
+gray_deltas = get_pass_deltas(gray_passes)
+
+# same as get_strength_matrix(kept, received) for the halves of hand and
+# other_hand, but one HandState visits every cell with a single card swapped
+# in and out per step: the rows go in revolving door order, and the columns of
+# each row run along the revolving door order, alternately forwards and
+# backwards.  the matrix is still indexed like all_passes.
+def get_incremental_strength_matrix(hand, other_hand):
+  codes = [hand_evaluation.CARD_TO_CODE[card] for card in hand]
+  other_codes = [hand_evaluation.CARD_TO_CODE[card] for card in other_hand]
+  state = hand_evaluation.HandState(
+    [codes[i] for i in range(hand_size) if i not in gray_passes[0]] +
+    [other_codes[i] for i in gray_passes[0]])
+  forwards = [(other_codes[leaving], other_codes[joining], j)
+              for (([leaving], [joining]), j) in zip(gray_deltas, gray_order[1:])]
+  backwards = [(other_codes[joining], other_codes[leaving], j)
+               for (([leaving], [joining]), j) in zip(gray_deltas, gray_order)][::-1]
+  matrix = [[None] * len(all_passes) for handpass in all_passes]
+  column = gray_order[0]
+  for (step, row) in enumerate(gray_order):
+    if step:
+      # the card leaving the pass is kept again, and the one joining it is not
+      ([leaving], [joining]) = gray_deltas[step - 1]
+      state.add_code(codes[leaving])
+      state.remove_code(codes[joining])
+    strengths = matrix[row]
+    strengths[column] = state.strength()
+    for (removed, added, column) in (backwards if step % 2 else forwards):
+      state.remove_code(removed)
+      state.add_code(added)
+      strengths[column] = state.strength()
+  return matrix
+
 def get_payoff_matrix(hand_A, hand_B):
-  payoff_matrix = []
-  for pass1 in itertools.combinations(range(hand_size), num_passed):
-    row = []
-    for pass2 in itertools.combinations(range(hand_size), num_passed):
-      new_hand_A = set() 
-      new_hand_B = set() 
-      for i in range(hand_size):
-        if i in pass1: new_hand_B.add(hand_A[i])
-        else:          new_hand_A.add(hand_A[i])
-        if i in pass2: new_hand_A.add(hand_B[i])
-        else:          new_hand_B.add(hand_B[i])
-      winner = hand_evaluation.poker_hand_comparator(new_hand_A, new_hand_B)
-
-      # best_hand_A = hand_evaluation.best_poker_hand(new_hand_A)
-      # best_hand_B = hand_evaluation.best_poker_hand(new_hand_B)
-      # old_winner = hand_evaluation.poker_hand_comparator(best_hand_A, best_hand_B)
-      # if (winner != old_winner): print winner, old_winner
-
-      row.append(winner)
-    payoff_matrix.append(row)
-  return payoff_matrix
+  (kept_A, passed_A) = get_half_hands(hand_A)
+  (kept_B, passed_B) = get_half_hands(hand_B)
+  strengths_A = get_strength_matrix(kept_A, passed_B)
+  if complement_passes is not None:
+    strengths_B = [[strengths_A[i][j] for j in complement_passes] for i in complement_passes]
+  else:
+    strengths_B = zip(*get_strength_matrix(kept_B, passed_A))
+  return [map(cmp, row_A, row_B) for (row_A, row_B) in zip(strengths_A, strengths_B)]
+
+# same as get_payoff_matrix, built with get_incremental_strength_matrix
+def get_incremental_payoff_matrix(hand_A, hand_B):
+  strengths_A = get_incremental_strength_matrix(hand_A, hand_B)
+  if complement_passes is not None:
+    strengths_B = [[strengths_A[i][j] for j in complement_passes] for i in complement_passes]
+  else:
+    strengths_B = zip(*get_incremental_strength_matrix(hand_B, hand_A))
+  return [map(cmp, row_A, row_B) for (row_A, row_B) in zip(strengths_A, strengths_B)]
+
+if np is not None:
+  pass_masks = get_pass_masks(all_passes, hand_size)
+
+# same as get_payoff_matrix, but builds all the post-pass hands at once and
+# returns an int8 numpy array
+def get_payoff_array(hand_A, hand_B):
+  bits_A = np.array([hand_evaluation.CARD_TO_BIT[card] for card in hand_A], dtype=np.int64)
+  bits_B = np.array([hand_evaluation.CARD_TO_BIT[card] for card in hand_B], dtype=np.int64)
+  (kept_A, passed_A) = get_half_hand_arrays(bits_A, pass_masks)
+  (kept_B, passed_B) = get_half_hand_arrays(bits_B, pass_masks)
+  new_hands_A = kept_A[:, None] | passed_B[None, :]
+  strengths_A = hand_evaluation.classify_masks(new_hands_A)
+  if complement_passes is not None:
+    strengths_B = strengths_A[np.ix_(complement_passes, complement_passes)]
+  else:
+    new_hands_B = passed_A[:, None] | kept_B[None, :]
+    strengths_B = hand_evaluation.classify_masks(new_hands_B)
+  return np.sign(strengths_A - strengths_B).astype(np.int8)
 
 def get_pass(i):
-  it = 0
-  for handpass in itertools.combinations(range(hand_size), num_passed):
-    if it == i:
-      return handpass
-    it+=1
+  return all_passes[i]
+
+# first pass with which player A never loses, or None
+def get_winning_row(payoff_matrix):
+  if np is not None and isinstance(payoff_matrix, np.ndarray):
+    rows = np.flatnonzero((payoff_matrix != -1).all(axis=1))
+    return rows[0] if len(rows) else None
+  for i in range(len(payoff_matrix)):
+    if -1 not in payoff_matrix[i]:
+      return i
+  return None
+
+# first pass with which player B never loses, or None
+def get_winning_column(payoff_matrix):
+  if np is not None and isinstance(payoff_matrix, np.ndarray):
+    columns = np.flatnonzero((payoff_matrix != 1).all(axis=0))
+    return columns[0] if len(columns) else None
+  for j in range(len(payoff_matrix)):
+    if all(row[j] != 1 for row in payoff_matrix):
+      return j
+  return None
 
 def find_winning_play(hand_A, hand_B, payoff_matrix, verbose = False):
   if verbose:
@@ -130,49 +333,117 @@ def find_winning_play(hand_A, hand_B, payoff_matrix, verbose = False):
     print 'Player A\'s hand: ', [card_to_string(x) for x in hand_A]
     print 'Player B\'s hand: ', [card_to_string(x) for x in hand_B]
     print
-  n = len(payoff_matrix)
-  for i in range(n):
-    winning = True
-    for j in range(n):
-      if payoff_matrix[i][j] == -1:
-        winning = False
-        break
-    if winning:
-      if verbose: 
-        handpass = get_pass(i)
-        print 'Player A has winning strategy by passing:'
-        print [card_to_string(hand_A[x]) for x in handpass]
-      return 1
-  for j in range(n):
-    winning = True
-    for i in range(n):
-      if payoff_matrix[i][j] == 1:
-        winning = False
-        break
-    if winning:
-      if verbose: 
-        handpass = get_pass(j)
-        print 'Player B has winning strategy by passing:'
-        print [card_to_string(hand_B[x]) for x in handpass]
-      return -1
+  i = get_winning_row(payoff_matrix)
+  if i is not None:
+    if verbose: 
+      handpass = get_pass(i)
+      print 'Player A has winning strategy by passing:'
+      print [card_to_string(hand_A[x]) for x in handpass]
+    return 1
+  j = get_winning_column(payoff_matrix)
+  if j is not None:
+    if verbose: 
+      handpass = get_pass(j)
+      print 'Player B has winning strategy by passing:'
+      print [card_to_string(hand_B[x]) for x in handpass]
+    return -1
   if verbose:
     print 'No winning play!'
     print
     print '---------------------------------------------------------'
   return 0
   
-if __name__=="__main__":
-  tally = {1: 0, 0: 0, -1: 0}
-  while True:
-    t = time.time()
-    (hand_A, hand_B) = generate_hands()
-    payoff_matrix = get_payoff_matrix(hand_A, hand_B)
-    #print 'got payoff matrix'
-    #print time.time() - t , 'seconds elapsed'
-  
-    t = time.time()
-    winner = find_winning_play(hand_A, hand_B, payoff_matrix)
-    tally[winner] += 1
-    print tally
-    print (tally[1] + tally[-1]) / (tally[1] + tally[-1] + tally[0] + 0.0) 
+# the payoff matrix, as an array when numpy is around
+def build_payoff_matrix(hand_A, hand_B):
+  if np is not None:
+    return get_payoff_array(hand_A, hand_B)
+  return get_payoff_matrix(hand_A, hand_B)
+
+# the payoff matrix of the same deal with players A and B trading places
+def swap_players(payoff_matrix):
+  if np is not None and isinstance(payoff_matrix, np.ndarray):
+    return -payoff_matrix.T
+  return [[-row[j] for row in payoff_matrix] for j in range(len(payoff_matrix[0]))]
+
+# indices of the passes of a hand with the given card ranks, weakest passed
+# cards first
+def get_pass_order(ranks, passes = all_passes):
+  return sorted(range(len(passes)), key = lambda i: sum(ranks[x] for x in passes[i]))
 
+# same answer as find_winning_play on the full payoff matrix, but cells are
+# only evaluated when needed: a row is abandoned at its first -1, a column at
+# its first 1, and passes giving away the weakest cards are tried first since
+# they are the likeliest to win.  returns (winner, the winner's winning pass or
+# None, number of cells evaluated)
+def solve_deal_lazily(hand_A, hand_B):
+  (kept_A, passed_A) = get_half_hands(hand_A)
+  (kept_B, passed_B) = get_half_hands(hand_B)
+  order_A = get_pass_order([card[0] for card in hand_A])
+  order_B = get_pass_order([card[0] for card in hand_B])
+  n = len(all_passes)
+  evaluate_mask = hand_evaluation.evaluate_mask
+  cells = {}
+
+  def get_cell(i, j):
+    winner = cells.get((i, j))
+    if winner is None:
+      winner = cmp(evaluate_mask(kept_A[i] | passed_B[j]),
+                   evaluate_mask(kept_B[j] | passed_A[i]))
+      cells[(i, j)] = winner
+    return winner
+
+  # columns where player A has won a cell are no use to player B
+  dead_columns = set()
+  for i in order_A:
+    for j in order_B:
+      winner = get_cell(i, j)
+      if winner == 1:
+        dead_columns.add(j)
+      elif winner == -1:
+        break
+    else:
+      return (1, i, len(cells))
+  for j in order_B:
+    if j in dead_columns:
+      continue
+    for i in order_A:
+      if get_cell(i, j) == 1:
+        break
+    else:
+      return (-1, j, len(cells))
+  return (0, None, len(cells))
+
+# same as solve_deal_lazily, but from the whole payoff array at once.  with
+# numpy, every cell in a handful of array operations beats a fraction of them
+# evaluated one at a time.
+def solve_deal_array(hand_A, hand_B):
+  payoff_array = get_payoff_array(hand_A, hand_B)
+  i = get_winning_row(payoff_array)
+  if i is not None:
+    return (1, i, payoff_array.size)
+  j = get_winning_column(payoff_array)
+  if j is not None:
+    return (-1, j, payoff_array.size)
+  return (0, None, payoff_array.size)
+
+# the quicker of the two
+if np is not None:
+  solve_deal_with_pass = solve_deal_array
+else:
+  solve_deal_with_pass = solve_deal_lazily
+
+# hand evaluations behind num_cells cells of a payoff matrix: two per cell,
+# except that a whole matrix takes one when complement_passes pairs up the
+# post-pass hands
+def hand_evaluations(num_cells, whole_matrix):
+  if whole_matrix and complement_passes is not None:
+    return num_cells
+  return 2 * num_cells
+
+# returns 1 if player A can force a win, -1 if player B can, and 0 otherwise
+def solve_deal(hand_A, hand_B):
+  return solve_deal_with_pass(hand_A, hand_B)[0]
+
+if __name__=="__main__":
+  import monte_carlo
+  monte_carlo.main()
@@ -0,0 +1,93 @@
+import numpy as np
+
+# value and optimal mixed strategies of the zero-sum game given by a payoff
+# matrix (player A picks the row and maximizes, player B picks the column).
+#
+# dominated passes are thrown out first, which keeps the value (though not
+# necessarily every optimal strategy) and usually leaves a much smaller game,
+# and what is left is solved exactly as a linear program with the simplex
+# method.
+
+EPSILON = 1e-9
+
+# indices of the rows and columns left after iterated elimination of weakly
+# dominated rows and columns (of identical rows or columns, the first is kept)
+def eliminate_dominated(payoff_matrix):
+  matrix = np.asarray(payoff_matrix)
+  rows = np.arange(matrix.shape[0])
+  columns = np.arange(matrix.shape[1])
+  while True:
+    sub = matrix[np.ix_(rows, columns)]
+    keep_rows = undominated(sub)
+    rows = rows[keep_rows]
+    sub = sub[keep_rows]
+    keep_columns = undominated(-sub.T)
+    columns = columns[keep_columns]
+    if keep_rows.all() and keep_columns.all():
+      return (rows, columns)
+
+# mask of the rows of matrix that no other row weakly dominates, for a
+# maximizing player
+def undominated(matrix):
+  n = matrix.shape[0]
+  # at_least[a, b]: row a is at least as good as row b everywhere
+  at_least = (matrix[:, None, :] >= matrix[None, :, :]).all(axis=2)
+  np.fill_diagonal(at_least, False)
+  strictly = at_least & ~at_least.T
+  earlier_twin = np.triu(at_least & at_least.T, 1) # a < b and identical
+  dominated = (strictly | earlier_twin).any(axis=0)
+  return ~dominated
+
+# solves max 1.v subject to matrix.v <= 1, v >= 0 for a positive matrix.
+# returns (v, u) where u is the dual solution.
+def simplex(matrix):
+  (m, n) = matrix.shape
+  tableau = np.zeros((m + 1, n + m + 1))
+  tableau[:m, :n] = matrix
+  tableau[:m, n:n + m] = np.eye(m)
+  tableau[:m, -1] = 1
+  tableau[m, :n] = -1
+  basis = list(range(n, n + m))
+  while True:
+    # bland's rule: lowest improving column, and lowest basis index among
+    # tied ratios, so degenerate pivots can't cycle
+    improving = np.flatnonzero(tableau[m, :-1] < -EPSILON)
+    if not len(improving):
+      break
+    entering = improving[0]
+    column = tableau[:m, entering]
+    candidates = np.flatnonzero(column > EPSILON)
+    ratios = tableau[candidates, -1] / column[candidates]
+    best = candidates[ratios <= ratios.min() + EPSILON]
+    leaving = min(best, key = lambda row: basis[row])
+    tableau[leaving] /= tableau[leaving, entering]
+    for row in range(m + 1):
+      if row != leaving and tableau[row, entering] != 0:
+        tableau[row] -= tableau[row, entering] * tableau[leaving]
+    basis[leaving] = entering
+
+  v = np.zeros(n)
+  for (row, variable) in enumerate(basis):
+    if variable < n:
+      v[variable] = tableau[row, -1]
+  u = tableau[m, n:n + m].copy()
+  return (v, u)
+
+# returns (value, row strategy, column strategy) for player A
+def solve_game(payoff_matrix):
+  matrix = np.asarray(payoff_matrix, dtype=float)
+  (rows, columns) = eliminate_dominated(matrix)
+  sub = matrix[np.ix_(rows, columns)]
+  row_strategy = np.zeros(matrix.shape[0])
+  column_strategy = np.zeros(matrix.shape[1])
+
+  # shift payoffs to be positive, so the game value is positive too
+  shift = 1 - sub.min()
+  (v, u) = simplex(sub + shift)
+  total = v.sum()
+  row_strategy[rows] = u / u.sum()
+  column_strategy[columns] = v / total
+  return (1 / total - shift, row_strategy, column_strategy)
+
+def game_value(payoff_matrix):
+  return solve_game(payoff_matrix)[0]
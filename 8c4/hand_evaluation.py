@@ -1,10 +1,30 @@
 import collections
 import contextlib
+import hashlib
 import itertools
 import json
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
 import time
+import zlib
 
+import tracing
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+# the best five cards of a hand, in the order they were given
 def best_poker_hand(cards):
+    return tuple(best_five(cards)[1])
+
+# the original best_poker_hand: classifies every 5-card subset.  kept for
+# comparison.
+def old_best_poker_hand(cards):
     all_hands = itertools.combinations(cards, 5)
     best = None
     for hand in all_hands:
@@ -24,12 +44,7 @@ def old_compare_poker_hand(handA, handB):
 #returns 0 if hand a ties hand b
 # returns > 0 if hand a > hand b
 def compare_poker_hand(handA, handB):
-    classA = classify_hand(handA)
-    classB = classify_hand(handB)
-    if classA[0] != classB[0]:
-        return classA[0] - classB[0]
-    else:
-        return classA[1] - classB[1]
+    return hand_strength(handA) - hand_strength(handB)
 
 def poker_hand_comparator(handA, handB):
   diff = compare_poker_hand(handA, handB)
@@ -54,16 +69,16 @@ HIGH           = 1
 pow_base= 100
 pows = [pow_base**i for i in range(5)]
 
-hands_memo = None
+# how classify_hand evaluates 5-card hands: 'direct' works out the strength,
+# 'memo' looks it up in the hands memo, mapping it in on first use.  bigger
+# hands are always evaluated directly.  see set_classify_mode.
+CLASSIFY_MODES = ('direct', 'memo')
+classify_mode = 'direct'
+
 def classify_hand(hand):
-  return full_classify_hand(hand);
-  global hands_memo
-  if not hands_memo:
-      with profiler('Loading memo...'):
-          with open('final_hands_memo.dat') as f:
-              hands_memo = json.load(f)
-  key = str(sorted(hand))
-  return hands_memo[key]
+  if classify_mode == 'memo' and len(hand) == 5:
+    return memo_classify_hand(hand)
+  return decode_strength(hand_strength(hand))
 
 def get_straight(ranks): # set of numbers
   rank_order = [14] + range(2, 15)
@@ -276,7 +291,8 @@ def full_classify_hand(hand):
 
     if (len(rank_count_sets[3]) >= 1):
       assert len(rank_count_sets[2]) == 0 and len(rank_count_sets[3]) == 1 and len(rank_count_sets[4]) == 0
-      return (KIND3, get_tiebreak(rank_count_sets[1], 2))
+      trips = max(rank_count_sets[3])
+      return (KIND3, trips * pows[2] + get_tiebreak(rank_count_sets[1], 2))
 
     # CHECK FOR TWO-PAIR
 
@@ -300,51 +316,678 @@ def full_classify_hand(hand):
     tiebreak = get_tiebreak(rank_count_sets[1])
     return (HIGH, tiebreak)
 
-def hash_hand(hand):
-    return str(sorted(hand))
-
-profiling_depth = 0
+#####################
+# FAST EVALUATION
+#####################
+
+# cards are encoded as integers in [0, 52): (rank - 2) * 4 + suit index.
+# a hand is a 52-bit mask with one bit per card, laid out as four 13-bit
+# blocks of rank bits (one block per suit, lowest rank in the lowest bit), so
+# each suit's ranks fall out of a shift and an and, and two disjoint hands
+# merge with a single or.
+#
+# evaluation returns an integer strength, category * CATEGORY_SHIFT + tiebreak,
+# which orders exactly like the (category, tiebreak) tuples of
+# full_classify_hand.
+
+SUIT_INDEX = {suit: i for i, suit in enumerate(SUITS)}
+NUM_RANKS = 13
+RANK_MASK = (1 << NUM_RANKS) - 1
+CATEGORY_SHIFT = pow_base ** 5
+
+def encode_card(card):
+  return (card[0] - 2) * 4 + SUIT_INDEX[card[1]]
+
+def decode_card(code):
+  return (code // 4 + 2, SUITS[code % 4])
+
+CARD_BITS = [1 << (NUM_RANKS * (code % 4) + code // 4) for code in xrange(52)]
+CARD_TO_BIT = {decode_card(code): CARD_BITS[code] for code in xrange(52)}
+CARD_TO_CODE = {decode_card(code): code for code in xrange(52)}
+CODE_TO_CARD = [decode_card(code) for code in xrange(52)]
+
+def hand_to_mask(hand):
+  mask = 0
+  for card in hand:
+    mask |= CARD_TO_BIT[card]
+  return mask
+
+def codes_to_mask(codes):
+  mask = 0
+  for code in codes:
+    mask |= CARD_BITS[code]
+  return mask
+
+def mask_to_hand(mask):
+  return [CODE_TO_CARD[code] for code in xrange(52) if mask & CARD_BITS[code]]
+
+def decode_strength(strength):
+  return divmod(strength, CATEGORY_SHIFT)
+
+# lookup tables indexed by a 13-bit set of ranks
+BIT_COUNT = [0] * (1 << NUM_RANKS)
+TOP_BIT = [0] * (1 << NUM_RANKS)  # highest set bit
+TOP_RANK = [0] * (1 << NUM_RANKS) # rank of the highest set bit
+TOP2 = [0] * (1 << NUM_RANKS)     # get_tiebreak of the two highest ranks
+TOP3 = [0] * (1 << NUM_RANKS)
+TOP5 = [0] * (1 << NUM_RANKS)
+STRAIGHT_HIGH = [0] * (1 << NUM_RANKS) # get_straight of the ranks
+
+def _build_tables():
+  for ranks_mask in xrange(1, 1 << NUM_RANKS):
+    ranks = [i + 2 for i in xrange(NUM_RANKS) if ranks_mask & (1 << i)]
+    BIT_COUNT[ranks_mask] = len(ranks)
+    TOP_BIT[ranks_mask] = 1 << (ranks[-1] - 2)
+    TOP_RANK[ranks_mask] = ranks[-1]
+    tiebreak = 0
+    for i in xrange(min(5, len(ranks))):
+      tiebreak = tiebreak * pow_base + ranks[-1 - i]
+      if i == 1: TOP2[ranks_mask] = tiebreak
+      if i == 2: TOP3[ranks_mask] = tiebreak
+      if i == 4: TOP5[ranks_mask] = tiebreak
+    if len(ranks) >= 5:
+      STRAIGHT_HIGH[ranks_mask] = get_straight(ranks)
+_build_tables()
+
+def evaluate_mask(mask):
+  s0 = mask & RANK_MASK
+  s1 = (mask >> NUM_RANKS) & RANK_MASK
+  s2 = (mask >> (2 * NUM_RANKS)) & RANK_MASK
+  s3 = mask >> (3 * NUM_RANKS)
+
+  # CHECK FOR A STRAIGHT FLUSH (and remember the best flush for later)
+
+  straight_flush = 0
+  flush = 0
+  for suit_ranks in (s0, s1, s2, s3):
+    if BIT_COUNT[suit_ranks] >= 5:
+      if STRAIGHT_HIGH[suit_ranks] > straight_flush:
+        straight_flush = STRAIGHT_HIGH[suit_ranks]
+      if TOP5[suit_ranks] > flush:
+        flush = TOP5[suit_ranks]
+  if straight_flush:
+    return STRAIGHT_FLUSH * CATEGORY_SHIFT + straight_flush
+
+  # CHECK FOR FOUR OF A KIND
+
+  four = s0 & s1 & s2 & s3
+  if four:
+    return KIND4 * CATEGORY_SHIFT + TOP_RANK[four]
+
+  # ranks held at least three times, at least twice, and at all
+  both01 = s0 & s1
+  both23 = s2 & s3
+  either01 = s0 | s1
+  either23 = s2 | s3
+  three = (both01 & either23) | (both23 & either01)
+  two = both01 | both23 | (either01 & either23)
+  return evaluate_counts(flush, three, two, either01 | either23)
+
+# the rest of evaluate_mask, once straight flushes and four of a kind are
+# ruled out.  flush is the best flush's TOP5 (or 0), and three, two and ranks
+# are the rank masks held at least three times, twice and once.
+def evaluate_counts(flush, three, two, ranks):
+  pairs = two & ~three
+
+  # CHECK FOR FULL HOUSE
+
+  if three and (pairs or BIT_COUNT[three] >= 2):
+    return FULL_HOUSE * CATEGORY_SHIFT + TOP_RANK[three]
+
+  # CHECK FOR FLUSH
+
+  if flush:
+    return FLUSH * CATEGORY_SHIFT + flush
+
+  # CHECK FOR STRAIGHT
+
+  straight = STRAIGHT_HIGH[ranks]
+  if straight:
+    return STRAIGHT * CATEGORY_SHIFT + straight
+
+  singles = ranks & ~two
+
+  # CHECK FOR THREE OF A KIND
+
+  if three:
+    return KIND3 * CATEGORY_SHIFT + TOP_RANK[three] * pows[2] + TOP2[singles]
+
+  # CHECK FOR TWO-PAIR / PAIR
+
+  if pairs:
+    high_pair = TOP_BIT[pairs]
+    rest = pairs ^ high_pair
+    if rest:
+      low_pair = TOP_BIT[rest]
+      kicker = TOP_RANK[(rest ^ low_pair) | singles]
+      return (TWO_PAIR * CATEGORY_SHIFT + TOP_RANK[high_pair] * pows[2] +
+              TOP_RANK[low_pair] * pows[1] + kicker)
+    return PAIR * CATEGORY_SHIFT + TOP_RANK[high_pair] * pows[3] + TOP3[singles]
+
+  # CHECK FOR HIGH
+
+  return HIGH * CATEGORY_SHIFT + TOP5[singles]
+
+# the five ranks of the straight with the given high rank
+def straight_ranks(high):
+  if high == 5:
+    return (1 << (14 - 2)) | 0b1111
+  return 0b11111 << (high - 6)
+
+# the highest count of the ranks
+def top_ranks(ranks, count):
+  top = 0
+  for i in xrange(count):
+    top |= TOP_BIT[ranks ^ top]
+  return top
+
+# every card of the given ranks is (ranks * ALL_SUITS) & mask
+ALL_SUITS = 1 | (1 << NUM_RANKS) | (1 << (2 * NUM_RANKS)) | (1 << (3 * NUM_RANKS))
+
+# one card of each of the ranks, from the lowest suit holding it
+def one_card_each(s0, s1, s2, s3, ranks):
+  return ((s0 & ranks) | ((s1 & ranks & ~s0) << NUM_RANKS) |
+          ((s2 & ranks & ~(s0 | s1)) << (2 * NUM_RANKS)) |
+          ((s3 & ranks & ~(s0 | s1 | s2)) << (3 * NUM_RANKS)))
+
+# (evaluate_mask(mask), mask of five of its cards with that strength).  the
+# category says which ranks make the hand, and the suits' rank masks say
+# which cards those are.  the ranks of a pair, trips or quads are held
+# exactly that often (except the pair of a full house, which may be trips),
+# and so are the kickers of a flush, trips, a pair or a high card hand, so
+# most of the five are just every card of their ranks.
+def best_five_mask(mask):
+  strength = evaluate_mask(mask)
+  (category, value) = divmod(strength, CATEGORY_SHIFT)
+  s0 = mask & RANK_MASK
+  s1 = (mask >> NUM_RANKS) & RANK_MASK
+  s2 = (mask >> (2 * NUM_RANKS)) & RANK_MASK
+  s3 = mask >> (3 * NUM_RANKS)
+
+  if category == STRAIGHT_FLUSH or category == FLUSH:
+    for (suit, suit_ranks) in enumerate((s0, s1, s2, s3)):
+      if BIT_COUNT[suit_ranks] < 5:
+        continue
+      if category == STRAIGHT_FLUSH and STRAIGHT_HIGH[suit_ranks] == value:
+        return (strength, straight_ranks(value) << (NUM_RANKS * suit))
+      if category == FLUSH and TOP5[suit_ranks] == value:
+        return (strength, top_ranks(suit_ranks, 5) << (NUM_RANKS * suit))
+
+  ranks = s0 | s1 | s2 | s3
+  if category == STRAIGHT:
+    return (strength, one_card_each(s0, s1, s2, s3, straight_ranks(value)))
+  two = (s0 & s1) | (s2 & s3) | ((s0 | s1) & (s2 | s3))
+  singles = ranks & ~two
+  if category == HIGH:
+    return (strength, top_ranks(singles, 5) * ALL_SUITS & mask)
+  if category == PAIR:
+    return (strength, (two | top_ranks(singles, 3)) * ALL_SUITS & mask)
+  if category == TWO_PAIR:
+    pairs = top_ranks(two, 2)
+    return (strength, pairs * ALL_SUITS & mask |
+                      one_card_each(s0, s1, s2, s3, TOP_BIT[ranks ^ pairs]))
+  three = ((s0 & s1) & (s2 | s3)) | ((s2 & s3) & (s0 | s1))
+  if category == KIND3:
+    return (strength, (three | top_ranks(singles, 2)) * ALL_SUITS & mask)
+  if category == FULL_HOUSE:
+    trips = TOP_BIT[three]
+    pair_rank = TOP_BIT[two ^ trips]
+    pair = pair_rank * ALL_SUITS & mask
+    if pair_rank & three:
+      pair ^= 1 << (pair.bit_length() - 1) # keep the two lowest suits
+    return (strength, trips * ALL_SUITS & mask | pair)
+  quads = TOP_BIT[s0 & s1 & s2 & s3]
+  return (strength, quads * ALL_SUITS & mask | one_card_each(s0, s1, s2, s3, TOP_BIT[ranks ^ quads]))
+
+# (hand_strength(hand), the five cards of hand making it)
+def best_five(hand):
+  (strength, five) = best_five_mask(hand_to_mask(hand))
+  return (strength, [card for card in hand if five & CARD_TO_BIT[card]])
+
+def hand_strength(hand):
+  if (len(hand) < 5): raise Exception('hand of wrong size')
+  return evaluate_mask(hand_to_mask(hand))
+
+# a hand that cards can be added to and removed from one at a time.  next to
+# the mask it keeps how many cards each suit and rank has, and the masks of
+# the ranks held at least once, twice, three and four times, so a change is a
+# few list updates and strength() can skip straight to the checks.
+class HandState(object):
+  __slots__ = ['mask', 'suit_counts', 'rank_counts', 'at_least']
+
+  def __init__(self, codes = ()):
+    self.mask = 0
+    self.suit_counts = [0, 0, 0, 0]
+    self.rank_counts = [0] * NUM_RANKS
+    self.at_least = [RANK_MASK, 0, 0, 0, 0] # at_least[n]: ranks held n or more times
+    for code in codes:
+      self.add_code(code)
+
+  def __len__(self):
+    return sum(self.suit_counts)
+
+  def add_code(self, code):
+    rank = code >> 2
+    self.mask |= CARD_BITS[code]
+    self.suit_counts[code & 3] += 1
+    rank_counts = self.rank_counts
+    rank_counts[rank] += 1
+    self.at_least[rank_counts[rank]] |= 1 << rank
+
+  def remove_code(self, code):
+    rank = code >> 2
+    self.mask ^= CARD_BITS[code]
+    self.suit_counts[code & 3] -= 1
+    rank_counts = self.rank_counts
+    self.at_least[rank_counts[rank]] ^= 1 << rank
+    rank_counts[rank] -= 1
+
+  def add(self, card):
+    self.add_code(CARD_TO_CODE[card])
+
+  def remove(self, card):
+    self.remove_code(CARD_TO_CODE[card])
+
+  # same as evaluate_mask(self.mask)
+  def strength(self):
+    flush = 0
+    if max(self.suit_counts) >= 5:
+      straight_flush = 0
+      for (suit, count) in enumerate(self.suit_counts):
+        if count >= 5:
+          suit_ranks = (self.mask >> (NUM_RANKS * suit)) & RANK_MASK
+          straight_flush = max(straight_flush, STRAIGHT_HIGH[suit_ranks])
+          flush = max(flush, TOP5[suit_ranks])
+      if straight_flush:
+        return STRAIGHT_FLUSH * CATEGORY_SHIFT + straight_flush
+    at_least = self.at_least
+    if at_least[4]:
+      return KIND4 * CATEGORY_SHIFT + TOP_RANK[at_least[4]]
+    return evaluate_counts(flush, at_least[3], at_least[2], at_least[1])
+
+#####################
+# DENSE RANKS
+#####################
+
+# there are 7462 distinct values of a 5-card poker hand.  hand_rank numbers
+# them 1 (7-5-4-3-2 offsuit) to 7462 (royal flush), so they fit in 16 bits.
+# the order is classify_hand's, except that four of a kind is also ranked by
+# its kicker and a full house by its pair, which classify_hand leaves tied
+# since two hands from one deck can never need them.
+
+NUM_HAND_RANKS = 7462
+
+# evaluate_mask's strength, with the kicker of quads or the pair of a full
+# house appended as an extra base-100 digit
+def rank_key(mask):
+  strength = evaluate_mask(mask)
+  category = strength // CATEGORY_SHIFT
+  if category != KIND4 and category != FULL_HOUSE:
+    return strength * pow_base
+  s0 = mask & RANK_MASK
+  s1 = (mask >> NUM_RANKS) & RANK_MASK
+  s2 = (mask >> (2 * NUM_RANKS)) & RANK_MASK
+  s3 = mask >> (3 * NUM_RANKS)
+  ranks = s0 | s1 | s2 | s3
+  if category == KIND4:
+    return strength * pow_base + TOP_RANK[ranks ^ TOP_BIT[s0 & s1 & s2 & s3]]
+  three = ((s0 & s1) & (s2 | s3)) | ((s2 & s3) & (s0 | s1))
+  two = (s0 & s1) | (s2 & s3) | ((s0 | s1) & (s2 | s3))
+  return strength * pow_base + TOP_RANK[two ^ TOP_BIT[three]]
+
+# one 5-card hand for every distinct hand value
+def _representative_hands():
+  for ranks in itertools.combinations(xrange(NUM_RANKS), 5):
+    yield [rank * 4 for rank in ranks] # flush
+  for ranks in itertools.combinations_with_replacement(xrange(NUM_RANKS), 5):
+    if any(ranks.count(rank) > 4 for rank in ranks):
+      continue
+    # the i-th copy of a rank goes in the i-th suit, and five different ranks
+    # get one card moved out of the first suit
+    codes = [rank * 4 + ranks[:i].count(rank) for (i, rank) in enumerate(ranks)]
+    if len(set(ranks)) == 5:
+      codes[-1] += 1
+    yield codes
+
+RANK_KEYS = sorted(set(rank_key(codes_to_mask(codes)) for codes in _representative_hands()))
+assert len(RANK_KEYS) == NUM_HAND_RANKS
+RANK_OF_KEY = {key: i + 1 for (i, key) in enumerate(RANK_KEYS)}
+# evaluate_mask strength of each rank, indexed from 1
+STRENGTH_OF_RANK = [0] + [key // pow_base for key in RANK_KEYS]
+
+def mask_rank(mask):
+  return RANK_OF_KEY[rank_key(mask)]
+
+def hand_rank(hand):
+  if (len(hand) < 5): raise Exception('hand of wrong size')
+  return mask_rank(hand_to_mask(hand))
+
+#####################
+# BATCH EVALUATION
+#####################
+
+# numpy versions of evaluate_mask and mask_rank, running the same steps on
+# whole arrays of hands at once.  each category is worked out for every hand
+# and np.select keeps the best one that applies.
+
+if np is not None:
+  NP_CARD_BITS = np.array(CARD_BITS, dtype=np.int64)
+  NP_BIT_COUNT = np.array(BIT_COUNT, dtype=np.int64)
+  NP_TOP_BIT = np.array(TOP_BIT, dtype=np.int64)
+  NP_TOP_RANK = np.array(TOP_RANK, dtype=np.int64)
+  NP_TOP2 = np.array(TOP2, dtype=np.int64)
+  NP_TOP3 = np.array(TOP3, dtype=np.int64)
+  NP_TOP5 = np.array(TOP5, dtype=np.int64)
+  NP_STRAIGHT_HIGH = np.array(STRAIGHT_HIGH, dtype=np.int64)
+  NP_RANK_KEYS = np.array(RANK_KEYS, dtype=np.int64)
+
+# (N, k) array of card codes -> (N,) array of masks
+def codes_to_masks(batch):
+  return np.bitwise_or.reduce(NP_CARD_BITS[np.asarray(batch)], axis=1)
+
+def _split_suits(masks):
+  return (masks & RANK_MASK,
+          (masks >> NUM_RANKS) & RANK_MASK,
+          (masks >> (2 * NUM_RANKS)) & RANK_MASK,
+          masks >> (3 * NUM_RANKS))
+
+# same as evaluate_mask, for an array of masks
+def classify_masks(masks):
+  masks = np.asarray(masks, dtype=np.int64)
+  (s0, s1, s2, s3) = _split_suits(masks)
+
+  straight_flush = np.zeros(masks.shape, dtype=np.int64)
+  flush = np.zeros(masks.shape, dtype=np.int64)
+  for suit_ranks in (s0, s1, s2, s3):
+    suited = NP_BIT_COUNT[suit_ranks] >= 5
+    straight_flush = np.maximum(straight_flush, np.where(suited, NP_STRAIGHT_HIGH[suit_ranks], 0))
+    flush = np.maximum(flush, np.where(suited, NP_TOP5[suit_ranks], 0))
+
+  four = s0 & s1 & s2 & s3
+  both01 = s0 & s1
+  both23 = s2 & s3
+  either01 = s0 | s1
+  either23 = s2 | s3
+  three = (both01 & either23) | (both23 & either01)
+  two = both01 | both23 | (either01 & either23)
+  pairs = two & ~three
+  ranks = either01 | either23
+  singles = ranks & ~two
+  straight = NP_STRAIGHT_HIGH[ranks]
+  high_pair = NP_TOP_BIT[pairs]
+  rest = pairs ^ high_pair
+  low_pair = NP_TOP_BIT[rest]
+
+  conditions = [
+    straight_flush > 0,
+    four != 0,
+    (three != 0) & ((pairs != 0) | (NP_BIT_COUNT[three] >= 2)),
+    flush > 0,
+    straight > 0,
+    three != 0,
+    rest != 0,
+    pairs != 0,
+  ]
+  choices = [
+    STRAIGHT_FLUSH * CATEGORY_SHIFT + straight_flush,
+    KIND4 * CATEGORY_SHIFT + NP_TOP_RANK[four],
+    FULL_HOUSE * CATEGORY_SHIFT + NP_TOP_RANK[three],
+    FLUSH * CATEGORY_SHIFT + flush,
+    STRAIGHT * CATEGORY_SHIFT + straight,
+    KIND3 * CATEGORY_SHIFT + NP_TOP_RANK[three] * pows[2] + NP_TOP2[singles],
+    (TWO_PAIR * CATEGORY_SHIFT + NP_TOP_RANK[high_pair] * pows[2] +
+     NP_TOP_RANK[low_pair] * pows[1] + NP_TOP_RANK[(rest ^ low_pair) | singles]),
+    PAIR * CATEGORY_SHIFT + NP_TOP_RANK[high_pair] * pows[3] + NP_TOP3[singles],
+  ]
+  return np.select(conditions, choices, HIGH * CATEGORY_SHIFT + NP_TOP5[singles])
+
+# same as mask_rank, for an array of masks
+def rank_masks(masks):
+  masks = np.asarray(masks, dtype=np.int64)
+  strengths = classify_masks(masks)
+  (s0, s1, s2, s3) = _split_suits(masks)
+  ranks = s0 | s1 | s2 | s3
+  four = s0 & s1 & s2 & s3
+  three = ((s0 & s1) & (s2 | s3)) | ((s2 & s3) & (s0 | s1))
+  two = (s0 & s1) | (s2 & s3) | ((s0 | s1) & (s2 | s3))
+  category = strengths // CATEGORY_SHIFT
+  extra = np.select(
+    [category == KIND4, category == FULL_HOUSE],
+    [NP_TOP_RANK[ranks ^ NP_TOP_BIT[four]], NP_TOP_RANK[two ^ NP_TOP_BIT[three]]],
+    0)
+  keys = strengths * pow_base + extra
+  return (np.searchsorted(NP_RANK_KEYS, keys) + 1).astype(np.uint16)
+
+# (N, k) array of card codes -> (N,) array of evaluate_mask strengths
+def classify_hands(batch):
+  return classify_masks(codes_to_masks(batch))
+
+# (N, k) array of card codes -> (N,) array of hand_rank ranks
+def rank_hands(batch):
+  return rank_masks(codes_to_masks(batch))
+
+# messages are indented by how many profiler blocks the printing thread is in,
+# and printed whole even when several threads print at once
+print_lock = threading.Lock()
 
 def pretty_print(msg):
-    global profiling_depth
-    print '%s%s' % (profiling_depth*'  ', msg)
+    line = '%s%s' % (tracing.TRACER.depth()*'  ', msg)
+    with print_lock:
+        print line
 
 
+# times the block as a tracing span, printing msg before and the time taken
+# after
 @contextlib.contextmanager
 def profiler(msg):
-    global profiling_depth
     pretty_print(msg)
-    profiling_depth += 1
     cur_time = time.time()
-    yield
+    with tracing.span(msg):
+        yield
     elapsed_time = time.time() - cur_time
-    profiling_depth -= 1
     pretty_print('Done! Took %04fs.' % (elapsed_time,))
 
 
-def precompute_hands():
-    deck = [(value, suit) for value in xrange(2, 15) for suit in ('c', 'd', 'h', 's')]
-    memo = {}
-    max_size = 2598960
-    pct_done = 0
-    with profiler('Computing %s hand strengths...' % (max_size,)):
-        for hand in itertools.combinations(deck, 5):
-            strength = classify_hand(hand)
-            key = hash_hand(hand)
-            assert(key not in memo), 'Collision at %s hands.' % (len(memo),)
-            memo[key] = strength
-            if len(memo) > (pct_done + 1)*max_size/100:
-                pct_done += 1
-                pretty_print('%s%% done' % (pct_done,))
-    assert(len(memo) == max_size)
-    print 'Got %s hands total.' % (len(memo),)
-    with profiler('Dumping to JSON...'):
-        memo_json = json.dumps(memo)
-    with profiler('Writing to disk...'):
-        with open('hands_memo.dat', 'w') as f:
-            f.write(memo_json)
+#####################
+# HANDS MEMO
+#####################
+
+# the memo is a flat binary file holding one little-endian 2-byte hand_rank per
+# 5-card hand, at the hand's position in the combinatorial number system:
+# the sorted card codes c0 < c1 < ... < c4 live at sum(C(c_i, i + 1)).
+# lookups are index math into an mmap, so opening it costs nothing and only
+# the pages actually touched are ever read.
+
+HANDS_MEMO_PATH = 'hands_memo.bin'
+NUM_FIVE_CARD_HANDS = 2598960
+MEMO_ENTRY = struct.Struct('<H')
+
+CHOOSE = [[1, 0, 0, 0, 0, 0]] # CHOOSE[n][k] for n <= 52, k <= 5
+for n in xrange(1, 53):
+  CHOOSE.append([1] + [CHOOSE[n - 1][k - 1] + CHOOSE[n - 1][k] for k in xrange(1, 6)])
+
+def hand_index(codes): # sorted card codes
+  index = 0
+  for i, code in enumerate(codes):
+    index += CHOOSE[code][i + 1]
+  return index
+
+def load_hands_memo(path = HANDS_MEMO_PATH):
+  with open(path, 'rb') as f:
+    memo = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+  if len(memo) != NUM_FIVE_CARD_HANDS * MEMO_ENTRY.size:
+    raise Exception('%s is not a hands memo' % (path,))
+  return memo
+
+# INDEX_TERMS[i][code] is the term hand_index adds for code as the i-th card
+INDEX_TERMS = [tuple(CHOOSE[code][i + 1] for code in xrange(52)) for i in xrange(5)]
+# classify_hand of each rank, indexed from 1
+CLASS_OF_RANK = [decode_strength(strength) for strength in STRENGTH_OF_RANK]
+
+hands_memo = None
+hands_memo_path = HANDS_MEMO_PATH
+
+def get_hands_memo():
+  global hands_memo
+  if hands_memo is None:
+    with profiler('Loading memo...'):
+      hands_memo = load_hands_memo(hands_memo_path)
+  return hands_memo
+
+# reads every page of the memo once, so later lookups never wait on the disk
+def warm_hands_memo():
+  memo = get_hands_memo()
+  for offset in xrange(0, len(memo), mmap.PAGESIZE):
+    memo[offset]
+
+def memo_hand_rank(hand):
+  (c0, c1, c2, c3, c4) = sorted([CARD_TO_CODE[card] for card in hand])
+  (t0, t1, t2, t3, t4) = INDEX_TERMS
+  index = t0[c0] + t1[c1] + t2[c2] + t3[c3] + t4[c4]
+  memo = hands_memo if hands_memo is not None else get_hands_memo()
+  return MEMO_ENTRY.unpack_from(memo, index * MEMO_ENTRY.size)[0]
+
+def memo_classify_hand(hand):
+  return CLASS_OF_RANK[memo_hand_rank(hand)]
+
+# switches classify_hand between CLASSIFY_MODES.  the memo at path is still
+# only loaded when first needed, unless warm is set.
+def set_classify_mode(mode, path = HANDS_MEMO_PATH, warm = False):
+  global classify_mode, hands_memo, hands_memo_path
+  if mode not in CLASSIFY_MODES:
+    raise ValueError('unknown classify mode %r' % (mode,))
+  if path != hands_memo_path:
+    hands_memo = None
+    hands_memo_path = path
+  classify_mode = mode
+  if mode == 'memo' and warm:
+    warm_hands_memo()
+
+# the memo is computed in shards.  the hands whose highest card is h have the
+# indices from C(h, 5) up to C(h + 1, 5), so each shard is one contiguous
+# block of the file, written as soon as it is ready.  shards are computed in
+# worker processes, and only the shards in flight are ever held in memory.
+#
+# the file is built as path + '.partial', with the CRC-32 of every shard
+# written so far in path + '.progress', so an interrupted run picks up after
+# the last shard it finished.  once all are in, every shard is read back and
+# checked against its CRC, the SHA-256 of the whole file goes to
+# path + '.sha256', and the file is moved into place.
+
+MEMO_SHARDS = range(4, 52) # highest cards
+
+def memo_shard_range(highest):
+    return (CHOOSE[highest][5], CHOOSE[highest + 1][5])
+
+# (highest, the shard's memo entries, packed, the tracing spans recorded since
+# the last shard).  the spans let worker processes' shards show up in the
+# parent's trace.
+def rank_memo_shard(highest):
+    with tracing.span('shard', highest = highest):
+        data = pack_memo_shard(highest)
+    return (highest, data, tracing.TRACER.drain())
+
+def pack_memo_shard(highest):
+    (start, end) = memo_shard_range(highest)
+    if np is not None:
+        batch = np.array([rest + (highest,) for rest in itertools.combinations(xrange(highest), 4)])
+        indices = np.array(CHOOSE, dtype=np.int64)[batch, np.arange(1, 6)].sum(axis=1) - start
+        shard = np.zeros(end - start, dtype=np.dtype(MEMO_ENTRY.format))
+        shard[indices] = rank_hands(batch)
+        return shard.tobytes()
+    shard = bytearray((end - start) * MEMO_ENTRY.size)
+    for rest in itertools.combinations(xrange(highest), 4):
+        codes = rest + (highest,)
+        MEMO_ENTRY.pack_into(shard, (hand_index(codes) - start) * MEMO_ENTRY.size,
+                             mask_rank(codes_to_mask(codes)))
+    return str(shard)
+
+def shard_checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def save_progress(path, checksums):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checksums, f)
+    os.rename(path + '.tmp', path)
+
+def file_sha256(path, chunk_size = 1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def verify_hands_memo(path = HANDS_MEMO_PATH):
+    with open(path + '.sha256') as f:
+        return f.read().strip() == file_sha256(path)
+
+def precompute_hands(path = HANDS_MEMO_PATH, processes = None):
+    partial = path + '.partial'
+    progress = path + '.progress'
+    checksums = {}
+    if os.path.exists(partial) and os.path.exists(progress):
+        with open(progress) as f:
+            checksums = {int(highest): checksum for (highest, checksum) in json.load(f).items()}
+        pretty_print('Resuming after %d of %d shards' % (len(checksums), len(MEMO_SHARDS)))
+    else:
+        with open(partial, 'wb') as f:
+            f.truncate(NUM_FIVE_CARD_HANDS * MEMO_ENTRY.size)
+    remaining = [highest for highest in MEMO_SHARDS if highest not in checksums]
+
+    with profiler('Computing %s hand ranks...' % (NUM_FIVE_CARD_HANDS,)):
+        # the workers are forked inside the span, so it is the parent of theirs
+        pool = multiprocessing.Pool(processes) if processes != 1 else None
+        try:
+            results = (pool.imap_unordered(rank_memo_shard, remaining) if pool is not None
+                       else itertools.imap(rank_memo_shard, remaining))
+            with open(partial, 'r+b') as f:
+                for (highest, data, spans) in results:
+                    tracing.TRACER.merge(spans)
+                    f.seek(memo_shard_range(highest)[0] * MEMO_ENTRY.size)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    checksums[highest] = shard_checksum(data)
+                    save_progress(progress, checksums)
+                    done = sum(memo_shard_range(shard)[1] - memo_shard_range(shard)[0]
+                               for shard in checksums)
+                    pretty_print('%s%% done' % (100 * done // NUM_FIVE_CARD_HANDS,))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    with profiler('Verifying...'):
+        with open(partial, 'rb') as f:
+            for highest in MEMO_SHARDS:
+                (start, end) = memo_shard_range(highest)
+                f.seek(start * MEMO_ENTRY.size)
+                if shard_checksum(f.read((end - start) * MEMO_ENTRY.size)) != checksums[highest]:
+                    # recompute it next time
+                    del checksums[highest]
+                    save_progress(progress, checksums)
+                    raise Exception('shard %d of %s is corrupt' % (highest, partial))
+        with open(path + '.sha256', 'w') as f:
+            f.write(file_sha256(partial) + '\n')
+    os.rename(partial, path)
+    os.remove(progress)
 
 
 if __name__ == '__main__':
-    #precompute_hands()
-    pass
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Precompute the 5-card hand rank memo.')
+    parser.add_argument('--path', type=str, default=HANDS_MEMO_PATH, help='File to write')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes (defaults to one per core)')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Save a chrome trace of the run to this file')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check an existing memo against its SHA-256 instead')
+    args = parser.parse_args()
+    if args.verify:
+        ok = verify_hands_memo(args.path)
+        print '%s %s its SHA-256' % (args.path, 'matches' if ok else 'does NOT match')
+        sys.exit(0 if ok else 1)
+    precompute_hands(args.path, args.processes)
+    if args.trace is not None:
+        tracing.TRACER.save_chrome_trace(args.trace)
@@ -0,0 +1,125 @@
+import collections
+import cProfile
+import json
+import os
+import time
+
+# counters and per-phase timers for the simulator.  instrumented code takes a
+# stats object and calls count() and timer() on it once per deal or batch,
+# never per cell or per evaluated hand, so the hot loops are untouched.
+# without instrumentation it gets NULL_STATS, whose methods do nothing.
+#
+# stats from worker processes travel back as to_dict() and are merged in.
+
+class Stats(object):
+  enabled = True
+
+  def __init__(self):
+    self.counters = collections.Counter()
+    self.seconds = collections.Counter()
+    self.timings = collections.Counter() # how many times each phase was timed
+
+  def count(self, name, amount = 1):
+    self.counters[name] += amount
+
+  def add_time(self, phase, seconds):
+    self.seconds[phase] += seconds
+    self.timings[phase] += 1
+
+  # with stats.timer('phase'): adds the time spent in the block to the phase
+  def timer(self, phase):
+    return Timer(self, phase)
+
+  def merge(self, other):
+    if isinstance(other, dict):
+      other = Stats.from_dict(other)
+    self.counters.update(other.counters)
+    self.seconds.update(other.seconds)
+    self.timings.update(other.timings)
+
+  def to_dict(self):
+    return {'counters': dict(self.counters), 'seconds': dict(self.seconds),
+            'timings': dict(self.timings)}
+
+  @staticmethod
+  def from_dict(state):
+    stats = Stats()
+    stats.counters.update(state['counters'])
+    stats.seconds.update(state['seconds'])
+    stats.timings.update(state['timings'])
+    return stats
+
+  def summary(self):
+    lines = ['counters:']
+    for name in sorted(self.counters):
+      lines.append('  %-24s %14d' % (name, self.counters[name]))
+    lines.append('phases:')
+    total = sum(self.seconds.values())
+    for phase in sorted(self.seconds, key = self.seconds.get, reverse = True):
+      seconds = self.seconds[phase]
+      lines.append('  %-24s %10.3fs %6.1f%% %10.2f us each' % (
+        phase, seconds, 100 * seconds / total if total else 0,
+        seconds / self.timings[phase] * 1e6))
+    return '\n'.join(lines)
+
+  def save(self, path):
+    with open(path, 'w') as f:
+      json.dump(self.to_dict(), f, indent = 2, sort_keys = True)
+
+class Timer(object):
+  __slots__ = ['stats', 'phase', 'start']
+
+  def __init__(self, stats, phase):
+    self.stats = stats
+    self.phase = phase
+
+  def __enter__(self):
+    self.start = time.time()
+
+  def __exit__(self, *exc_info):
+    self.stats.add_time(self.phase, time.time() - self.start)
+
+class NullTimer(object):
+  def __enter__(self):
+    pass
+
+  def __exit__(self, *exc_info):
+    pass
+
+NULL_TIMER = NullTimer()
+
+# the same interface as Stats, doing nothing
+class NullStats(object):
+  enabled = False
+
+  def count(self, name, amount = 1):
+    pass
+
+  def add_time(self, phase, seconds):
+    pass
+
+  def timer(self, phase):
+    return NULL_TIMER
+
+  def merge(self, other):
+    pass
+
+  def to_dict(self):
+    return None
+
+NULL_STATS = NullStats()
+
+def get_stats(enabled):
+  return Stats() if enabled else NULL_STATS
+
+# runs function(*args) under cProfile and dumps the profile to path, for
+# pstats or snakeviz
+def profile_call(path, function, *args):
+  profile = cProfile.Profile()
+  try:
+    return profile.runcall(function, *args)
+  finally:
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    profile.dump_stats(path)
@@ -0,0 +1,41 @@
+import math
+
+import hand_evaluation
+
+# relabelling the suits of a deal never changes who can force a win, so deals
+# are grouped into classes under the 4! suit permutations.
+#
+# a deal is described suit by suit: for each suit, the pair (ranks A holds in
+# it, ranks B holds in it) as 13-bit masks.  permuting suits permutes these
+# blocks, so sorting them gives a form shared by exactly the deals in a class.
+
+NUM_SUIT_PERMUTATIONS = math.factorial(len(hand_evaluation.SUITS))
+
+def suit_blocks(mask_A, mask_B):
+  return [((mask_A >> (hand_evaluation.NUM_RANKS * suit)) & hand_evaluation.RANK_MASK,
+           (mask_B >> (hand_evaluation.NUM_RANKS * suit)) & hand_evaluation.RANK_MASK)
+          for suit in range(len(hand_evaluation.SUITS))]
+
+def canonical_deal(mask_A, mask_B):
+  return tuple(sorted(suit_blocks(mask_A, mask_B), reverse = True))
+
+def canonical_hands(hand_A, hand_B):
+  return canonical_deal(hand_evaluation.hand_to_mask(hand_A),
+                        hand_evaluation.hand_to_mask(hand_B))
+
+# the deal laid out by a canonical form, as a pair of card masks
+def deal_masks(canonical):
+  mask_A = 0
+  mask_B = 0
+  for (suit, (ranks_A, ranks_B)) in enumerate(canonical):
+    mask_A |= ranks_A << (hand_evaluation.NUM_RANKS * suit)
+    mask_B |= ranks_B << (hand_evaluation.NUM_RANKS * suit)
+  return (mask_A, mask_B)
+
+# number of distinct deals in the class of a canonical form: suits holding the
+# same cards for both players can be swapped without changing the deal
+def class_size(canonical):
+  size = NUM_SUIT_PERMUTATIONS
+  for block in set(canonical):
+    size //= math.factorial(canonical.count(block))
+  return size
@@ -0,0 +1,449 @@
+import argparse
+import collections
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import deal_cache
+import deal_log
+import game_simulator
+import hand_evaluation
+import instrumentation
+import isomorphism
+import tracing
+
+try:
+  import game_value # needs numpy
+except ImportError:
+  game_value = None
+
+parser = argparse.ArgumentParser(
+  description='Estimate how often one player can force a win in 8-choose-4.')
+parser.add_argument('--deals', type=int, default=None,
+                    help='Stop after this many deals')
+parser.add_argument('--ci-width', type=float, default=None,
+                    help='Stop once the confidence interval is this narrow')
+parser.add_argument('--relative-error', type=float, default=None,
+                    help='Stop once the interval half-width is this fraction of the estimate')
+parser.add_argument('--interval', choices=['normal', 'wilson', 'clopper-pearson'],
+                    default='wilson', help='Confidence interval used by the stopping rules')
+parser.add_argument('--confidence', type=float, default=0.95,
+                    help='Confidence level of the interval')
+parser.add_argument('--checkpoint', type=str, default=None,
+                    help='File to periodically save the tally to, and resume from')
+parser.add_argument('--checkpoint-every', type=float, default=60,
+                    help='Seconds between checkpoints')
+parser.add_argument('--seed', type=int, default=0, help='Master random seed')
+parser.add_argument('--processes', type=int, default=None,
+                    help='Worker processes (defaults to one per core)')
+parser.add_argument('--batch-size', type=int, default=50,
+                    help='Deals per unit of work')
+parser.add_argument('--cache-size', type=int, default=0,
+                    help='Outcomes each worker caches by canonical deal (0 to disable)')
+parser.add_argument('--game-values', action='store_true',
+                    help='Also solve every deal for its mixed-strategy game value (needs numpy)')
+parser.add_argument('--deal-log', type=str, default=None,
+                    help='Record every deal in this file (deals are then solved without the cache)')
+parser.add_argument('--stats', action='store_true',
+                    help='Count and time the phases of the simulation and print a summary')
+parser.add_argument('--stats-json', type=str, default=None,
+                    help='Also save the summary to this JSON file (implies --stats)')
+parser.add_argument('--profile-every', type=int, default=0,
+                    help='Run every n-th batch under cProfile (0 to never)')
+parser.add_argument('--profile-dir', type=str, default='profiles',
+                    help='Directory for the cProfile dumps')
+parser.add_argument('--trace', type=str, default=None,
+                    help='Save a chrome trace of every batch, from all workers, to this file')
+
+# the normal approximation behind the interval is meaningless for tiny samples
+MIN_DEALS_FOR_INTERVAL = 100
+
+# deals are simulated in fixed-size batches, and batch k always draws from the
+# same rng stream, seeded from (seed, k).  results are merged in batch order,
+# so the tally depends only on the master seed and the batch size, never on
+# how many workers there are.  random.Random seeds with the absolute value of
+# an integer, so negative seeds go in as their 64-bit two's complement.
+def batch_rng(seed, batch_index):
+  return random.Random(((seed & (2**64 - 1)) << 32) | batch_index)
+
+# each worker process keeps its own cache across batches
+worker_cache = None
+
+def get_cache(cache_size):
+  global worker_cache
+  if not cache_size:
+    return None
+  if worker_cache is None or worker_cache.max_size != cache_size:
+    worker_cache = deal_cache.DealCache(cache_size)
+  return worker_cache
+
+# game values are rounded to this many digits before being counted
+VALUE_DIGITS = 3
+
+# the winner's winning pass in a payoff matrix, or None
+def get_winning_pass(payoff_matrix, winner):
+  if winner == 1:
+    return game_simulator.get_winning_row(payoff_matrix)
+  if winner == -1:
+    return game_simulator.get_winning_column(payoff_matrix)
+  return None
+
+# returns the tally of forced wins, (if game_values is set) the counts of
+# each game value to player A, (if log_deals is set) the batch's deal log
+# records, packed, (if instrument is set) the batch's stats as a dict, and (if
+# trace is set) the worker's tracing spans.  with a profile path, the batch
+# runs under cProfile and the profile is dumped there.
+def simulate_batch(args):
+  (seed, batch_index, num_deals, cache_size, game_values, log_deals, instrument,
+   profile_path, trace) = args
+  stats = instrumentation.get_stats(instrument)
+  batch = (seed, batch_index, num_deals, cache_size, game_values, log_deals, stats)
+  with tracing.span('batch', index = batch_index, deals = num_deals):
+    if profile_path is not None:
+      result = instrumentation.profile_call(profile_path, play_batch, *batch)
+    else:
+      result = play_batch(*batch)
+  spans = tracing.TRACER.drain() if trace else None
+  return result + (stats.to_dict(), spans)
+
+def play_batch(seed, batch_index, num_deals, cache_size, game_values, log_deals, stats):
+  rng = batch_rng(seed, batch_index)
+  cache = get_cache(cache_size)
+  if cache is not None:
+    cache_counts = (cache.hits, cache.misses, cache.cells_evaluated)
+  tally = {1: 0, 0: 0, -1: 0}
+  values = collections.Counter()
+  records = []
+  whole_matrix = game_simulator.solve_deal_with_pass is not game_simulator.solve_deal_lazily
+  for i in range(num_deals):
+    with stats.timer('deal'):
+      (hand_A, hand_B) = game_simulator.generate_hands(rng)
+    start = time.time()
+    if log_deals:
+      # play the canonical form of the deal instead, which has the same
+      # outcome, so the logged pass is a pass of the logged hands
+      with stats.timer('canonicalize'):
+        (mask_A, mask_B) = isomorphism.deal_masks(isomorphism.canonical_hands(hand_A, hand_B))
+        hand_A = hand_evaluation.mask_to_hand(mask_A)
+        hand_B = hand_evaluation.mask_to_hand(mask_B)
+    if game_values:
+      with stats.timer('matrix'):
+        payoff_matrix = game_simulator.build_payoff_matrix(hand_A, hand_B)
+      with stats.timer('solve'):
+        winner = game_simulator.find_winning_play(hand_A, hand_B, payoff_matrix)
+        winning_pass = get_winning_pass(payoff_matrix, winner)
+      with stats.timer('game value'):
+        values[round(game_value.game_value(payoff_matrix), VALUE_DIGITS)] += 1
+      stats.count('cells evaluated', len(payoff_matrix) ** 2)
+      stats.count('hand evaluations', game_simulator.hand_evaluations(len(payoff_matrix) ** 2, True))
+    elif cache is None or log_deals:
+      with stats.timer('solve'):
+        (winner, winning_pass, num_cells) = game_simulator.solve_deal_with_pass(hand_A, hand_B)
+      stats.count('cells evaluated', num_cells)
+      stats.count('hand evaluations', game_simulator.hand_evaluations(num_cells, whole_matrix))
+    else:
+      with stats.timer('solve'):
+        winner = cache.solve(hand_A, hand_B)
+    tally[winner] += 1
+    if log_deals:
+      records.append((batch_index, i, mask_A, mask_B, winner,
+                      deal_log.NO_PASS if winning_pass is None else int(winning_pass),
+                      time.time() - start))
+  stats.count('deals', num_deals)
+  if cache is not None:
+    (hits, misses, cells_evaluated) = cache_counts
+    stats.count('cache hits', cache.hits - hits)
+    stats.count('cache misses', cache.misses - misses)
+    stats.count('cells evaluated', cache.cells_evaluated - cells_evaluated)
+    stats.count('hand evaluations', game_simulator.hand_evaluations(
+      cache.cells_evaluated - cells_evaluated, whole_matrix))
+  return (tally, values, deal_log.pack_records(records) if log_deals else None)
+
+def merge_tallies(tally, other):
+  for winner in other:
+    tally[winner] += other[winner]
+
+def report_values(values, num_bins = 8):
+  total = sum(values.values())
+  if not total:
+    return
+  mean = sum(value * count for (value, count) in values.items()) / float(total)
+  print 'game value to player A: mean %.5f over %d deals' % (mean, total)
+  bins = [0] * num_bins
+  for (value, count) in values.items():
+    bins[min(num_bins - 1, int((value + 1) / 2 * num_bins))] += count
+  for (i, count) in enumerate(bins):
+    low = -1 + 2.0 * i / num_bins
+    print '  [%+.2f, %+.2f%s %6.2f%%' % (low, low + 2.0 / num_bins,
+                                        ']' if i == num_bins - 1 else ')',
+                                        100.0 * count / total)
+
+#####################
+# CONFIDENCE INTERVALS
+#####################
+
+def normal_quantile(p):
+  low, high = -40.0, 40.0
+  for i in range(100):
+    mid = (low + high) / 2
+    if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+      low = mid
+    else:
+      high = mid
+  return (low + high) / 2
+
+def _beta_continued_fraction(x, a, b):
+  tiny = 1e-300
+  c = 1.0
+  d = 1 - (a + b) * x / (a + 1)
+  d = 1 / (d if abs(d) > tiny else tiny)
+  h = d
+  for m in range(1, 100000):
+    for numerator in (m * (b - m) * x / ((a + 2*m - 1) * (a + 2*m)),
+                      -(a + m) * (a + b + m) * x / ((a + 2*m) * (a + 2*m + 1))):
+      d = 1 + numerator * d
+      d = 1 / (d if abs(d) > tiny else tiny)
+      c = 1 + numerator / c
+      c = c if abs(c) > tiny else tiny
+      h *= d * c
+    if abs(d * c - 1) < 1e-14:
+      break
+  return h
+
+# regularized incomplete beta function I_x(a, b)
+def beta_cdf(x, a, b):
+  if x <= 0: return 0.0
+  if x >= 1: return 1.0
+  front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                   a * math.log(x) + b * math.log(1 - x))
+  if x < (a + 1.0) / (a + b + 2):
+    return front * _beta_continued_fraction(x, a, b) / a
+  return 1 - front * _beta_continued_fraction(1 - x, b, a) / b
+
+def beta_quantile(p, a, b):
+  low, high = 0.0, 1.0
+  for i in range(60):
+    mid = (low + high) / 2
+    if beta_cdf(mid, a, b) < p:
+      low = mid
+    else:
+      high = mid
+  return (low + high) / 2
+
+# (low, high) interval on the success probability of successes / total
+def confidence_interval(successes, total, method = 'wilson', confidence = 0.95):
+  if total == 0:
+    return (0.0, 1.0)
+  alpha = 1 - confidence
+  fraction = successes / float(total)
+  if method == 'normal':
+    half_width = normal_quantile(1 - alpha / 2) * math.sqrt(fraction * (1 - fraction) / total)
+    return (max(0.0, fraction - half_width), min(1.0, fraction + half_width))
+  if method == 'wilson':
+    z = normal_quantile(1 - alpha / 2)
+    center = (fraction + z*z / (2*total)) / (1 + z*z / total)
+    half_width = (z / (1 + z*z / total) *
+                  math.sqrt(fraction * (1 - fraction) / total + z*z / (4*total*total)))
+    return (max(0.0, center - half_width), min(1.0, center + half_width))
+  if method == 'clopper-pearson':
+    failures = total - successes
+    low = beta_quantile(alpha / 2, successes, failures + 1) if successes else 0.0
+    high = beta_quantile(1 - alpha / 2, successes + 1, failures) if failures else 1.0
+    return (low, high)
+  raise Exception('unknown interval %s' % (method,))
+
+# fraction of deals where someone has a forced win, and its standard error
+def forced_win_estimate(tally):
+  total = sum(tally.values())
+  if total == 0:
+    return (0.0, float('inf'))
+  fraction = (tally[1] + tally[-1]) / float(total)
+  return (fraction, math.sqrt(fraction * (1 - fraction) / total))
+
+def forced_win_interval(tally, method = 'wilson', confidence = 0.95):
+  return confidence_interval(tally[1] + tally[-1], sum(tally.values()), method, confidence)
+
+class StoppingRule(object):
+  def __init__(self, num_deals = None, ci_width = None, relative_error = None,
+               method = 'wilson', confidence = 0.95):
+    self.num_deals = num_deals
+    self.ci_width = ci_width
+    self.relative_error = relative_error
+    self.method = method
+    self.confidence = confidence
+
+  # size of batch batch_index, or 0 once the deal budget is used up
+  def batch_size(self, batch_index, batch_size):
+    if self.num_deals is None:
+      return batch_size
+    return max(0, min(batch_size, self.num_deals - batch_index * batch_size))
+
+  def precise_enough(self, tally):
+    if self.ci_width is None and self.relative_error is None:
+      return False
+    total = sum(tally.values())
+    if self.method == 'normal' and total < MIN_DEALS_FOR_INTERVAL:
+      return False
+    (low, high) = forced_win_interval(tally, self.method, self.confidence)
+    if self.ci_width is not None and high - low <= self.ci_width:
+      return True
+    (fraction, std_error) = forced_win_estimate(tally)
+    if (self.relative_error is not None and fraction > 0 and
+        (high - low) / 2 <= self.relative_error * fraction):
+      return True
+    return False
+
+#####################
+# CHECKPOINTS
+#####################
+
+def save_checkpoint(path, seed, batch_size, batches_done, tally, values):
+  state = {
+    'seed': seed,
+    'batch_size': batch_size,
+    'batches_done': batches_done,
+    'tally': {str(winner): tally[winner] for winner in tally},
+    'values': values.items(),
+  }
+  with open(path + '.tmp', 'w') as f:
+    json.dump(state, f)
+  os.rename(path + '.tmp', path)
+
+# returns (batches_done, tally, values) saved by an earlier run with the same
+# settings
+def load_checkpoint(path, seed, batch_size):
+  with open(path) as f:
+    state = json.load(f)
+  if state['seed'] != seed or state['batch_size'] != batch_size:
+    raise Exception('checkpoint %s was made with seed %s and batch size %s' % (
+      path, state['seed'], state['batch_size']))
+  tally = {int(winner): count for (winner, count) in state['tally'].items()}
+  values = collections.Counter(dict(state.get('values', [])))
+  return (state['batches_done'], tally, values)
+
+#####################
+# DRIVER
+#####################
+
+def report(tally, elapsed, rule = None, deals_at_start = 0):
+  total = sum(tally.values())
+  (fraction, std_error) = forced_win_estimate(tally)
+  print tally
+  print '%d deals, forced win fraction %.5f +/- %.5f (%.1f deals/s)' % (
+    total, fraction, std_error, (total - deals_at_start) / elapsed if elapsed else 0)
+  if rule is not None and total:
+    (low, high) = forced_win_interval(tally, rule.method, rule.confidence)
+    print '%g%% %s interval: [%.5f, %.5f]' % (rule.confidence * 100, rule.method, low, high)
+
+# simulates deals until the stopping rule is satisfied (or forever, if it sets
+# no targets).  with a checkpoint path, the tally is saved there every
+# checkpoint_every seconds and on exit, and a later run with the same seed and
+# batch size picks up where it left off.  with a deal log path, every deal
+# merged into the tally is recorded there, in order.  stats (from
+# instrumentation.get_stats) collects counters and phase times from the
+# workers, and with profile_every every that many-th batch is profiled into
+# profile_dir.  with trace set, the workers' tracing spans are merged into
+# tracing.TRACER.  returns the tally of forced wins and the counts of game
+# values (empty unless game_values is set).
+def run_simulation(rule, seed = 0, processes = None, batch_size = 50,
+                   checkpoint = None, checkpoint_every = 60, cache_size = 0,
+                   game_values = False, verbose = True, log_path = None,
+                   stats = instrumentation.NULL_STATS, profile_every = 0,
+                   profile_dir = 'profiles', trace = False):
+  if game_values and game_value is None:
+    raise Exception('game values need numpy')
+  tally = {1: 0, 0: 0, -1: 0}
+  values = collections.Counter()
+  batches_done = 0
+  if checkpoint is not None and os.path.exists(checkpoint):
+    (batches_done, tally, values) = load_checkpoint(checkpoint, seed, batch_size)
+    if verbose:
+      print 'Resuming from %s after %d deals' % (checkpoint, sum(tally.values()))
+
+  # drop whatever a previous run logged past its checkpoint
+  writer = None
+  if log_path is not None:
+    writer = deal_log.DealWriter(log_path, seed, batch_size, sum(tally.values()))
+
+  processes = processes or multiprocessing.cpu_count()
+  pool = multiprocessing.Pool(processes)
+  start = time.time()
+  deals_at_start = sum(tally.values())
+  last_checkpoint = start
+  done = rule.precise_enough(tally)
+  try:
+    while not done:
+      # hand out a few batches per worker at a time, so the stopping rule can
+      # end the run without a backlog of queued work
+      batches = []
+      for batch_index in range(batches_done, batches_done + 4 * processes):
+        size = rule.batch_size(batch_index, batch_size)
+        if size == 0:
+          break
+        profile_path = None
+        if profile_every and batch_index % profile_every == 0:
+          profile_path = os.path.join(profile_dir, 'batch-%d.prof' % (batch_index,))
+        batches.append((seed, batch_index, size, cache_size, game_values,
+                        writer is not None, stats.enabled, profile_path, trace))
+      if not batches:
+        break
+
+      for (batch_tally, batch_values, records, batch_stats, spans) in pool.imap(simulate_batch, batches):
+        merge_tallies(tally, batch_tally)
+        values.update(batch_values)
+        stats.merge(batch_stats)
+        if trace:
+          tracing.TRACER.merge(spans)
+        if writer is not None:
+          with stats.timer('log'):
+            writer.write_packed(records)
+        batches_done += 1
+        if rule.precise_enough(tally):
+          done = True
+          break
+      if verbose:
+        report(tally, time.time() - start, rule, deals_at_start)
+      if checkpoint is not None and time.time() - last_checkpoint >= checkpoint_every:
+        with stats.timer('checkpoint'):
+          # the log must hold every deal the checkpoint counts
+          if writer is not None:
+            writer.flush(sync = True)
+          save_checkpoint(checkpoint, seed, batch_size, batches_done, tally, values)
+        last_checkpoint = time.time()
+  finally:
+    pool.terminate()
+    if writer is not None:
+      writer.close()
+    if checkpoint is not None:
+      save_checkpoint(checkpoint, seed, batch_size, batches_done, tally, values)
+  if verbose:
+    print
+    report(tally, time.time() - start, rule, deals_at_start)
+    report_values(values)
+  return (tally, values)
+
+def main():
+  args = parser.parse_args()
+  rule = StoppingRule(args.deals, args.ci_width, args.relative_error,
+                      args.interval, args.confidence)
+  stats = instrumentation.get_stats(args.stats or args.stats_json is not None)
+  # the workers are forked inside this span, so it is the parent of theirs
+  with tracing.span('simulation', seed = args.seed):
+    run_simulation(rule, args.seed, args.processes, args.batch_size,
+                   args.checkpoint, args.checkpoint_every, args.cache_size,
+                   args.game_values, log_path = args.deal_log, stats = stats,
+                   profile_every = args.profile_every, profile_dir = args.profile_dir,
+                   trace = args.trace is not None)
+  if stats.enabled:
+    print
+    print stats.summary()
+  if args.stats_json is not None:
+    stats.save(args.stats_json)
+  if args.trace is not None:
+    tracing.TRACER.save_chrome_trace(args.trace)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,138 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+import game_simulator
+import hand_evaluation
+
+# the passing game with any hand size, pass size and number of players.  each
+# player is dealt hand_size cards and gives num_passed of them to the next
+# player (the last one gives to the first), all at once.  a player can force a
+# win with a pass if, whatever everyone else passes, nobody ends up with a
+# better hand.
+#
+# game_simulator is this game with 8 cards, 4 passed and 2 players, and stays
+# the faster choice for it.
+
+# higher is better under every rule
+RULES = {
+  'high': hand_evaluation.classify_masks,
+  'low': lambda masks: -hand_evaluation.classify_masks(masks),
+}
+
+parser = argparse.ArgumentParser(
+  description='Simulate the passing game for any hand size, pass size and number of players.')
+parser.add_argument('--hand-size', type=int, default=8, help='Cards dealt to each player')
+parser.add_argument('--passed', type=int, default=4, help='Cards each player passes on')
+parser.add_argument('--players', type=int, default=2, help='Number of players')
+parser.add_argument('--rule', choices=sorted(RULES), default='high',
+                    help='Whether the best or the worst poker hand wins')
+parser.add_argument('--deals', type=int, default=1000, help='Deals to simulate')
+parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+# with two players, the passes are checked this many at a time, so a winning
+# pass found early saves evaluating the rest
+CHUNK_SIZE = 32
+
+class PassingGame(object):
+  def __init__(self, hand_size = 8, num_passed = 4, num_players = 2, rule = 'high'):
+    if num_players < 2 or hand_size * num_players > 52:
+      raise ValueError('cannot deal %d hands of %d cards' % (num_players, hand_size))
+    if hand_size < 5 or not 0 <= num_passed <= hand_size:
+      raise ValueError('cannot pass %d cards of %d' % (num_passed, hand_size))
+    self.hand_size = hand_size
+    self.num_passed = num_passed
+    self.num_players = num_players
+    self.rule = rule
+    self.evaluate = RULES[rule]
+    self.passes = game_simulator.get_passes(hand_size, num_passed)
+    self.pass_masks = game_simulator.get_pass_masks(self.passes, hand_size)
+
+  # a list of num_players hands of card codes
+  def deal(self, rng = random):
+    return game_simulator.deal_codes(rng, self.num_players, self.hand_size)
+
+  # (player, pass) for the first player who can force a win and a pass that
+  # does it, or (None, None)
+  def solve(self, hands):
+    halves = [game_simulator.get_half_hand_arrays(hand_evaluation.NP_CARD_BITS[codes], self.pass_masks)
+              for codes in hands]
+    if self.num_players == 2:
+      return self.solve_two_players(hands, halves)
+    return self.solve_many_players(halves)
+
+  # the strengths of kept[i] combined with received[j]
+  def get_strengths(self, kept, received):
+    return self.evaluate(kept[:, None] | received[None, :])
+
+  # a pass wins if the player's hand is at least as good as the opponent's
+  # for every pass of theirs.  the passes are tried in chunks, weakest first,
+  # evaluating only the strengths those chunks need.
+  def solve_two_players(self, hands, halves):
+    for player in (0, 1):
+      (kept, passed) = halves[player]
+      (other_kept, other_passed) = halves[1 - player]
+      order = np.array(game_simulator.get_pass_order([code >> 2 for code in hands[player]],
+                                                      self.passes))
+      for start in range(0, len(order), CHUNK_SIZE):
+        chunk = order[start:start + CHUNK_SIZE]
+        strengths = self.get_strengths(kept[chunk], other_passed)
+        other_strengths = self.get_strengths(other_kept, passed[chunk])
+        winning = np.flatnonzero((strengths >= other_strengths.T).all(axis=1))
+        if len(winning):
+          return (player, chunk[winning[0]])
+    return (None, None)
+
+  # every hand depends on only two passes, its owner's and the previous
+  # player's, so whether some opponent can beat a pass splits into checks on
+  # one strength matrix per player instead of all the passes at once
+  def solve_many_players(self, halves):
+    num_players = self.num_players
+    strengths = [self.get_strengths(halves[player][0], halves[player - 1][1])
+                 for player in range(num_players)]
+    for player in range(num_players):
+      own = strengths[player]
+      worst = own.min(axis=1)
+      loses = np.zeros(len(self.passes), dtype=bool)
+      for other in range(num_players):
+        if other == player:
+          continue
+        if other == (player + 1) % num_players:
+          # the next player holds what we pass
+          loses |= strengths[other].max(axis=0) > worst
+        elif other == (player - 1) % num_players:
+          # the previous player's pass is in our hand
+          loses |= (strengths[other].max(axis=1)[None, :] > own).any(axis=1)
+        else:
+          loses |= strengths[other].max() > worst
+      winning = np.flatnonzero(~loses)
+      if len(winning):
+        return (player, winning[0])
+    return (None, None)
+
+  # {winning player or None: number of deals}
+  def simulate(self, num_deals, rng = random):
+    tally = {None: 0}
+    tally.update((player, 0) for player in range(self.num_players))
+    for i in xrange(num_deals):
+      tally[self.solve(self.deal(rng))[0]] += 1
+    return tally
+
+def main():
+  args = parser.parse_args()
+  game = PassingGame(args.hand_size, args.passed, args.players, args.rule)
+  print '%d players, %d cards, %d passed, %s wins: %d passes per player' % (
+    args.players, args.hand_size, args.passed, args.rule, len(game.passes))
+  start = time.time()
+  tally = game.simulate(args.deals, random.Random(args.seed))
+  elapsed = time.time() - start
+  for player in range(args.players):
+    print 'player %d forces a win: %d (%.4f)' % (
+      player + 1, tally[player], float(tally[player]) / args.deals)
+  print 'no forced win: %d (%.4f)' % (tally[None], float(tally[None]) / args.deals)
+  print '%.1f deals/s' % (args.deals / elapsed,)
+
+if __name__ == '__main__':
+  main()
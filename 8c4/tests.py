@@ -1,5 +1,18 @@
+import itertools
+import os
+import random
+import tempfile
+import threading
+
+import deal_cache
+import deal_log
+import exact
 import game_simulator 
 import hand_evaluation
+import instrumentation
+import isomorphism
+import monte_carlo
+import tracing
 
 def compare_hands(handA, handB):
   handA = [game_simulator.string_to_card(x) for x in handA]
@@ -10,7 +23,7 @@ def assert_correct(hand_1, hand_2, value):
   actual_value = compare_hands(hand_1, hand_2)
   try:
     assert actual_value == value
-  except:
+  except AssertionError:
     print 'Test failed!'
     print '  Hand 1: ', hand_1
     print '    classification: ', hand_evaluation.classify_hand([game_simulator.string_to_card(x) for x in hand_1])
@@ -19,6 +32,7 @@ def assert_correct(hand_1, hand_2, value):
     print '  Should have been: ' , value
     print '  Instead was     : ' , actual_value
     print
+    raise
 
 def test_hands_list(hands_list):
   for i in range(len(hands_list)):
@@ -71,6 +85,17 @@ hands_list = [
 
 test_hands_list(hands_list)
 
+# three of a kind
+hands_list = [
+  ['Ac', 'As', 'Ad', '3c', '2s'],
+  ['Kc', 'Ks', 'Kd', 'Ac', 'Qs'],
+  ['Kc', 'Ks', 'Kd', 'Ac', 'Js'],
+  ['Kc', 'Ks', 'Kd', 'Qc', 'Js'],
+  ['2c', '2s', '2d', 'Ac', 'Ks'],
+]
+
+test_hands_list(hands_list)
+
 # two-pair
 hands_list = [
   ['4c', '4s', '5c', '6c', '6s'],
@@ -127,4 +152,465 @@ handA = ['2c', '4d', '8c', 'Qc', 'Ad']
 handB = ['2h', '4s', '8h', 'Qh', 'As']
 assert_correct(handA, handB, 0)
 
+# fast evaluator agrees with full_classify_hand
+def assert_same_classification(hand):
+  expected = hand_evaluation.full_classify_hand(hand)
+  actual = hand_evaluation.classify_hand(hand)
+  try:
+    assert actual == expected
+  except AssertionError:
+    print 'Test failed!'
+    print '  Hand: ', [game_simulator.card_to_string(x) for x in hand]
+    print '  Should have been: ' , expected
+    print '  Instead was     : ' , actual
+    print
+    raise
+
+random.seed(0)
+deck = [(value, suit) for value in range(2, 15) for suit in game_simulator.card_suits]
+for size in range(5, 9):
+  for i in range(2000):
+    assert_same_classification(random.sample(deck, size))
+
+# memo indices of the hands drawn from the lowest cards are exactly the lowest indices
+indices = [hand_evaluation.hand_index(codes) for codes in itertools.combinations(range(20), 5)]
+assert sorted(indices) == range(len(indices))
+
+# memo shards are contiguous blocks, filled with the ranks of their hands
+assert hand_evaluation.memo_shard_range(4)[0] == 0
+assert hand_evaluation.memo_shard_range(51)[1] == hand_evaluation.NUM_FIVE_CARD_HANDS
+for highest in (4, 9):
+  (start, end) = hand_evaluation.memo_shard_range(highest)
+  (shard, data, spans) = hand_evaluation.rank_memo_shard(highest)
+  assert shard == highest and [(span[2], span[7]) for span in spans] == [('shard', {'highest': highest})]
+  assert len(data) == (end - start) * hand_evaluation.MEMO_ENTRY.size
+  for rest in itertools.combinations(range(highest), 4):
+    codes = rest + (highest,)
+    offset = (hand_evaluation.hand_index(codes) - start) * hand_evaluation.MEMO_ENTRY.size
+    assert (hand_evaluation.MEMO_ENTRY.unpack_from(data, offset)[0] ==
+            hand_evaluation.mask_rank(hand_evaluation.codes_to_mask(codes)))
+
+# a memo checks out against its SHA-256 until a byte of it changes
+(handle, path) = tempfile.mkstemp()
+with os.fdopen(handle, 'wb') as f:
+  f.write(hand_evaluation.rank_memo_shard(9)[1])
+with open(path + '.sha256', 'w') as f:
+  f.write(hand_evaluation.file_sha256(path) + '\n')
+try:
+  assert hand_evaluation.verify_hands_memo(path)
+  with open(path, 'r+b') as f:
+    f.seek(100)
+    byte = f.read(1)
+    f.seek(100)
+    f.write(chr(ord(byte) ^ 1))
+  assert not hand_evaluation.verify_hands_memo(path)
+finally:
+  os.remove(path)
+  os.remove(path + '.sha256')
+
+# memo mode classifies 5-card hands from the memo and bigger ones directly.
+# only the shards of the hands drawn from the lowest ten cards are filled in.
+(memo_fd, memo_path) = tempfile.mkstemp()
+with os.fdopen(memo_fd, 'wb') as f:
+  f.truncate(hand_evaluation.NUM_FIVE_CARD_HANDS * hand_evaluation.MEMO_ENTRY.size)
+  for highest in range(4, 10):
+    f.seek(hand_evaluation.memo_shard_range(highest)[0] * hand_evaluation.MEMO_ENTRY.size)
+    f.write(hand_evaluation.rank_memo_shard(highest)[1])
+low_cards = [hand_evaluation.CODE_TO_CARD[code] for code in range(10)]
+hands = [list(hand) for hand in itertools.combinations(low_cards, 5)]
+hands += [random.sample(deck, 7) for i in range(100)]
+expected = [hand_evaluation.classify_hand(hand) for hand in hands]
+hand_evaluation.set_classify_mode('memo', memo_path, warm = True)
+try:
+  assert [hand_evaluation.classify_hand(hand) for hand in hands] == expected
+finally:
+  hand_evaluation.set_classify_mode('direct')
+  os.remove(memo_path)
+assert hand_evaluation.hands_memo is None
+
+# the numpy payoff matrix matches the plain one
+if game_simulator.np is not None:
+  for i in range(5):
+    (hand_A, hand_B) = game_simulator.generate_hands()
+    payoff_array = game_simulator.get_payoff_array(hand_A, hand_B)
+    assert payoff_array.tolist() == game_simulator.get_payoff_matrix(hand_A, hand_B)
+    assert (game_simulator.find_winning_play(hand_A, hand_B, payoff_array) ==
+            game_simulator.find_winning_play(hand_A, hand_B, payoff_array.tolist()))
+
+# deals that only differ by suit names share a canonical form and a cached outcome
+relabel = dict(zip(game_simulator.card_suits, ['h', 's', 'c', 'd']))
+(hand_A, hand_B) = game_simulator.generate_hands()
+relabelled_A = [(value, relabel[suit]) for (value, suit) in hand_A]
+relabelled_B = [(value, relabel[suit]) for (value, suit) in hand_B]
+assert isomorphism.canonical_hands(hand_A, hand_B) == isomorphism.canonical_hands(relabelled_A, relabelled_B)
+cache = deal_cache.DealCache(10)
+outcome = cache.solve(hand_A, hand_B)
+assert cache.solve(relabelled_A, relabelled_B) == outcome and cache.hits == 1
+assert game_simulator.solve_deal(relabelled_A, relabelled_B) == outcome
+
+# exact enumeration visits the canonical form of every deal from the J-A deck
+# once, and class_size counts the deals sharing it
+ranks = [11, 12, 13, 14]
+deck_codes = exact.deck_codes(ranks)
+classes = {}
+for codes_A in itertools.combinations(deck_codes, 8):
+  codes_B = [code for code in deck_codes if code not in codes_A]
+  canonical = isomorphism.canonical_deal(hand_evaluation.codes_to_mask(codes_A),
+                                         hand_evaluation.codes_to_mask(codes_B))
+  classes.setdefault(canonical, []).append((codes_A, codes_B))
+forms = list(exact.canonical_forms(ranks))
+assert len(forms) == len(set(forms)) and set(forms) == set(classes)
+for canonical in forms:
+  assert isomorphism.class_size(canonical) == len(classes[canonical])
+shards = [list(exact.canonical_classes(ranks, shard, 3)) for shard in range(3)]
+assert sorted(sum(shards, [])) == sorted(exact.canonical_classes(ranks))
+# every deal of a class has the outcome of its canonical form, and the tally
+# is the brute force count
+for canonical in random.sample(forms, 5):
+  tally = {1: 0, 0: 0, -1: 0}
+  exact.solve_class(canonical, True, tally)
+  outcomes = set(game_simulator.solve_deal(*[[hand_evaluation.decode_card(code) for code in codes]
+                                             for codes in deal])
+                 for deal in classes[canonical])
+  assert outcomes == set(winner for winner in tally if tally[winner])
+assert exact.enumerate_deals(ranks, processes = 1, verbose = False) == {1: 823, 0: 11224, -1: 823}
+
+# the lazy solver agrees with the full payoff matrix
+for i in range(20):
+  (hand_A, hand_B) = game_simulator.generate_hands()
+  payoff_matrix = game_simulator.get_payoff_matrix(hand_A, hand_B)
+  (winner, handpass, num_cells) = game_simulator.solve_deal_lazily(hand_A, hand_B)
+  assert winner == game_simulator.find_winning_play(hand_A, hand_B, payoff_matrix)
+  if winner == 1:
+    assert -1 not in payoff_matrix[handpass]
+  elif winner == -1:
+    assert all(row[handpass] != 1 for row in payoff_matrix)
+  assert num_cells <= len(payoff_matrix) ** 2
+  if game_simulator.np is not None:
+    (array_winner, array_pass, array_cells) = game_simulator.solve_deal_array(hand_A, hand_B)
+    assert array_winner == winner and array_cells == len(payoff_matrix) ** 2
+    if winner == 1:
+      assert -1 not in payoff_matrix[array_pass]
+    elif winner == -1:
+      assert all(row[array_pass] != 1 for row in payoff_matrix)
+
+# mixed-strategy game values
+if game_simulator.np is not None:
+  import game_value
+  assert game_value.game_value([[0, 1, -1], [-1, 0, 1], [1, -1, 0]]) == 0
+  assert abs(game_value.game_value([[3, 0], [0, 1]]) - 0.75) < 1e-9
+  # of identical rows or columns, the first is kept
+  assert [list(kept) for kept in game_value.eliminate_dominated([[1, 0], [1, 0], [0, 1]])] == [[0, 2], [0, 1]]
+  assert [list(kept) for kept in game_value.eliminate_dominated([[1, 1, 0], [0, 0, 1]])] == [[0, 1], [0, 2]]
+  for i in range(5):
+    (hand_A, hand_B) = game_simulator.generate_hands()
+    payoff_array = game_simulator.get_payoff_array(hand_A, hand_B)
+    (value, row_strategy, column_strategy) = game_value.solve_game(payoff_array)
+    assert (row_strategy.dot(payoff_array) >= value - 1e-9).all()
+    assert (payoff_array.dot(column_strategy) <= value + 1e-9).all()
+
+# dense hand ranks
+def hand_rank(hand):
+  return hand_evaluation.hand_rank([game_simulator.string_to_card(x) for x in hand])
+
+assert hand_rank(['7c', '5d', '4c', '3c', '2c']) == 1
+assert hand_rank(['10s', 'Js', 'Qs', 'Ks', 'As']) == hand_evaluation.NUM_HAND_RANKS
+assert hand_rank(['2c', '2d', '2h', '2s', '4c']) > hand_rank(['2c', '2d', '2h', '2s', '3c'])
+assert hand_rank(['2c', '2d', '2h', '4s', '4c']) > hand_rank(['2c', '2d', '2h', '3s', '3c'])
+for size in range(5, 9):
+  for i in range(500):
+    (hand_1, hand_2) = (random.sample(deck, size), random.sample(deck, size))
+    if hand_evaluation.classify_hand(hand_1) < hand_evaluation.classify_hand(hand_2):
+      assert hand_evaluation.hand_rank(hand_1) < hand_evaluation.hand_rank(hand_2)
+
+# batch evaluation agrees with one hand at a time
+if hand_evaluation.np is not None:
+  for size in range(5, 9):
+    batch = [random.sample(range(52), size) for i in range(500)]
+    masks = [hand_evaluation.codes_to_mask(codes) for codes in batch]
+    assert hand_evaluation.classify_hands(batch).tolist() == map(hand_evaluation.evaluate_mask, masks)
+    assert hand_evaluation.rank_hands(batch).tolist() == map(hand_evaluation.mask_rank, masks)
+
+# incremental hand states agree with evaluating the mask from scratch
+state = hand_evaluation.HandState()
+held = []
+for i in range(2000):
+  if len(held) > 5 and (len(held) == 9 or random.random() < 0.5):
+    state.remove_code(held.pop(random.randrange(len(held))))
+  else:
+    code = random.choice([code for code in range(52) if code not in held])
+    state.add_code(code)
+    held.append(code)
+  assert state.mask == hand_evaluation.codes_to_mask(held)
+  if len(held) >= 5:
+    assert state.strength() == hand_evaluation.evaluate_mask(state.mask)
+for i in range(5):
+  (hand_A, hand_B) = game_simulator.generate_hands()
+  assert game_simulator.get_incremental_payoff_matrix(hand_A, hand_B) == game_simulator.get_payoff_matrix(hand_A, hand_B)
+
+# revolving door order visits every pass once, changing one card per step
+for n in range(1, 10):
+  for k in range(n + 1):
+    order = list(game_simulator.revolving_door(n, k))
+    assert sorted(order) == list(itertools.combinations(range(n), k))
+    for (previous, current) in zip(order, order[1:]):
+      assert len(set(previous) - set(current)) == 1
+assert [game_simulator.all_passes[i] for i in game_simulator.gray_order] == game_simulator.gray_passes
+
+# pass numbering by the combinatorial number system
+assert game_simulator.all_passes == list(itertools.combinations(range(game_simulator.hand_size), game_simulator.num_passed))
+for n in range(10):
+  for k in range(n + 1):
+    for (i, combination) in enumerate(itertools.combinations(range(n), k)):
+      assert game_simulator.combination_rank(combination, n, k) == i
+      assert game_simulator.combination_at(i, n, k) == combination
+
+# pass tables for other hand sizes
+for (size, passed) in [(6, 3), (7, 3), (10, 5)]:
+  passes = game_simulator.get_passes(size, passed)
+  assert passes == list(itertools.combinations(range(size), passed))
+  complements = game_simulator.get_complement_passes(passes, size)
+  if 2 * passed != size:
+    assert complements is None
+  else:
+    for (handpass, complement) in zip(passes, complements):
+      assert sorted(handpass + passes[complement]) == range(size)
+
+# the general passing game agrees with game_simulator on 8-choose-4
+if game_simulator.np is not None:
+  import passing_game
+  game = passing_game.PassingGame(8, 4, 2)
+  for i in range(20):
+    hands = game.deal()
+    (hand_A, hand_B) = [[hand_evaluation.decode_card(code) for code in codes] for codes in hands]
+    (player, handpass) = game.solve(hands)
+    winner = game_simulator.find_winning_play(hand_A, hand_B, game_simulator.get_payoff_matrix(hand_A, hand_B))
+    assert winner == {0: 1, 1: -1, None: 0}[player]
+    if player is not None:
+      payoff_matrix = game_simulator.get_payoff_matrix(hand_A, hand_B)
+      if player == 1:
+        payoff_matrix = game_simulator.swap_players(payoff_matrix)
+      assert -1 not in payoff_matrix[handpass]
+  # with more players, against a search over every combination of passes
+  def winning_passes(game, hands):
+    sign = 1 if game.rule == 'high' else -1
+    num_players = game.num_players
+    winning = [set(range(len(game.passes))) for player in range(num_players)]
+    for choices in itertools.product(range(len(game.passes)), repeat = num_players):
+      passed = [[hands[player][x] for x in game.passes[choices[player]]] for player in range(num_players)]
+      strengths = []
+      for player in range(num_players):
+        kept = [code for code in hands[player] if code not in passed[player]]
+        mask = hand_evaluation.codes_to_mask(kept + passed[player - 1])
+        strengths.append(sign * hand_evaluation.evaluate_mask(mask))
+      for player in range(num_players):
+        if strengths[player] < max(strengths):
+          winning[player].discard(choices[player])
+    return winning
+  rng = random.Random(5)
+  for (hand_size, num_passed, num_players, rule) in [(5, 1, 3, 'high'), (5, 2, 3, 'high'),
+                                                     (5, 1, 4, 'high'), (6, 1, 3, 'low')]:
+    game = passing_game.PassingGame(hand_size, num_passed, num_players, rule)
+    for i in range(8):
+      hands = game.deal(rng)
+      winning = winning_passes(game, hands)
+      (player, handpass) = game.solve(hands)
+      winners = [p for p in range(num_players) if winning[p]]
+      if winners:
+        assert player == winners[0] and handpass in winning[player]
+      else:
+        assert (player, handpass) == (None, None)
+  game = passing_game.PassingGame(6, 2, 3)
+  assert sum(game.simulate(20).values()) == 20
+
+# deal logs read back what was written, with and without numpy
+(handle, path) = tempfile.mkstemp()
+os.close(handle)
+os.remove(path)
+records = [(0, i, random.getrandbits(52), random.getrandbits(52), random.choice([1, 0, -1]),
+            random.randrange(-1, 70), 0.5) for i in range(100)]
+with deal_log.DealWriter(path, 7, 50, buffer_size = 1000) as writer:
+  writer.write(*records[0])
+  writer.write_packed(deal_log.pack_records(records[1:]))
+assert list(deal_log.iter_deals(path)) == records
+with deal_log.DealWriter(path, 7, 50, num_records = 60) as writer:
+  pass
+assert list(deal_log.iter_deals(path)) == records[:60]
+# a log shorter than the checkpoint it resumes from is never padded
+try:
+  deal_log.DealWriter(path, 7, 50, num_records = 80).close()
+  padded = True
+except Exception:
+  padded = False
+assert not padded and list(deal_log.iter_deals(path)) == records[:60]
+if deal_log.np is not None:
+  (seed, batch_size, logged) = deal_log.read_deals(path)
+  assert (seed, batch_size) == (7, 50) and logged['mask_B'].tolist() == [r[3] for r in records[:60]]
+  del logged
+os.remove(path)
+# seeds can be negative, as batch_rng allows
+with deal_log.DealWriter(path, -1, 50) as writer:
+  writer.write(*records[0])
+with open(path, 'rb') as f:
+  assert deal_log.read_header(f) == (-1, 50)
+os.remove(path)
+
+# dealing draws distinct cards, reproducibly per stream
+for i in range(100):
+  (hand_A, hand_B) = game_simulator.generate_hands()
+  assert len(hand_A) == len(hand_B) == game_simulator.hand_size and len(set(hand_A + hand_B)) == 16
+if game_simulator.np is not None:
+  deals = game_simulator.deal_code_array(1000, game_simulator.deal_random_state(1, 2))
+  assert all(len(set(codes)) == 16 for codes in deals.tolist())
+  assert (deals == game_simulator.deal_code_array(1000, game_simulator.deal_random_state(1, 2))).all()
+  assert (deals != game_simulator.deal_code_array(1000, game_simulator.deal_random_state(1, 3))).any()
+  negative = game_simulator.deal_code_array(1000, game_simulator.deal_random_state(-1, 2))
+  assert (deals != negative).any()
+
+# best five cards
+def best_five(hand):
+  (strength, five) = hand_evaluation.best_five([game_simulator.string_to_card(x) for x in hand])
+  return sorted(game_simulator.card_to_string(card) for card in five)
+
+assert best_five(['2c', '2d', '2h', '7s', '7c', '7d', 'Ac', '3s']) == sorted(['7s', '7c', '7d', '2c', '2d'])
+assert best_five(['9c', '9d', '4h', '4s', 'Kc', '2d', '2h', 'Qs']) == sorted(['9c', '9d', '4h', '4s', 'Kc'])
+assert best_five(['Ah', '2h', '3h', '4h', '5h', '6d', '7h', 'Kh']) == sorted(['Ah', '2h', '3h', '4h', '5h'])
+assert best_five(['8s', '8c', '8d', '8h', '2c', '5d', '5h', 'Jh']) == sorted(['8s', '8c', '8d', '8h', 'Jh'])
+for size in range(5, 10):
+  for i in range(300):
+    hand = random.sample(deck, size)
+    (strength, five) = hand_evaluation.best_five(hand)
+    assert len(five) == 5 and set(five) <= set(hand)
+    assert strength == hand_evaluation.hand_strength(five) == hand_evaluation.hand_strength(hand)
+    if size <= 8 and i < 20:
+      assert hand_evaluation.old_compare_poker_hand(five, hand_evaluation.old_best_poker_hand(hand)) == 0
+
+# instrumentation merges counters and timers, and the null stats do nothing
+stats = instrumentation.Stats()
+with stats.timer('solve'):
+  stats.count('cells evaluated', 10)
+other = instrumentation.Stats()
+other.count('cells evaluated', 5)
+other.add_time('solve', 1.0)
+stats.merge(other.to_dict())
+assert stats.counters['cells evaluated'] == 15 and stats.timings['solve'] == 2
+assert stats.seconds['solve'] >= 1.0 and 'solve' in stats.summary()
+with instrumentation.NULL_STATS.timer('solve'):
+  instrumentation.NULL_STATS.count('cells evaluated')
+assert instrumentation.NULL_STATS.to_dict() is None
+
+# tracing spans nest per thread and survive a drain/merge round trip
+tracer = tracing.Tracer(max_spans = 100)
+def traced(n):
+  with tracer.span('outer', n = n):
+    with tracer.span('inner', n = n):
+      pass
+threads = [threading.Thread(target = traced, args = (n,)) for n in range(4)]
+for thread in threads:
+  thread.start()
+for thread in threads:
+  thread.join()
+spans = tracer.drain()
+assert len(spans) == 8 and not tracer.spans
+by_id = {span[0]: tracing.Span(*span) for span in spans}
+for span in by_id.values():
+  if span.name == 'inner':
+    assert by_id[span.parent].name == 'outer' and by_id[span.parent].args == span.args
+tracer.merge(spans)
+assert len(tracer.chrome_trace()['traceEvents']) == 8
+
+# the simulated tally depends on the seed, not on the number of workers
+rule = monte_carlo.StoppingRule(num_deals = 120)
+(tally, values) = monte_carlo.run_simulation(rule, 7, processes = 1, batch_size = 20, verbose = False)
+assert sum(tally.values()) == 120
+assert monte_carlo.run_simulation(rule, 7, processes = 2, batch_size = 20, verbose = False)[0] == tally
+# and a negative seed is not its absolute value
+assert monte_carlo.batch_rng(-1, 0).random() != monte_carlo.batch_rng(1, 0).random()
+assert (monte_carlo.run_simulation(rule, -1, processes = 1, batch_size = 20, verbose = False)[0] !=
+        monte_carlo.run_simulation(rule, 1, processes = 1, batch_size = 20, verbose = False)[0])
+
+# confidence intervals against known values
+assert abs(monte_carlo.normal_quantile(0.975) - 1.959964) < 1e-6
+assert abs(monte_carlo.normal_quantile(0.5)) < 1e-9
+assert abs(monte_carlo.beta_cdf(0.3, 2, 3) - 0.3483) < 1e-9
+assert abs(monte_carlo.beta_cdf(0.8, 3, 2) - (1 - monte_carlo.beta_cdf(0.2, 2, 3))) < 1e-12
+assert abs(monte_carlo.beta_quantile(0.3483, 2, 3) - 0.3) < 1e-9
+def assert_interval(interval, expected, tolerance = 5e-5):
+  assert all(abs(end - value) < tolerance for (end, value) in zip(interval, expected)), interval
+assert_interval(monte_carlo.confidence_interval(5, 20, 'clopper-pearson'), (0.0866, 0.4910))
+assert_interval(monte_carlo.confidence_interval(5, 20, 'wilson'), (0.1119, 0.4687))
+assert_interval(monte_carlo.confidence_interval(0, 10, 'clopper-pearson'), (0, 1 - 0.025 ** 0.1), 1e-9)
+assert_interval(monte_carlo.confidence_interval(10, 10, 'clopper-pearson'), (0.025 ** 0.1, 1), 1e-9)
+for method in ('normal', 'wilson'):
+  (low, high) = monte_carlo.confidence_interval(0, 10, method)
+  assert low == 0 and high < 1
+  (low, high) = monte_carlo.confidence_interval(10, 10, method)
+  assert low > 0 or method == 'normal'
+  assert high == 1
+assert monte_carlo.confidence_interval(0, 0) == (0.0, 1.0)
+
+# stopping rules
+tally = {1: 300, 0: 600, -1: 100}
+assert not monte_carlo.StoppingRule(num_deals = 10).precise_enough(tally)
+assert monte_carlo.StoppingRule(ci_width = 0.07).precise_enough(tally)
+assert not monte_carlo.StoppingRule(ci_width = 0.05).precise_enough(tally)
+assert monte_carlo.StoppingRule(relative_error = 0.08).precise_enough(tally)
+assert not monte_carlo.StoppingRule(relative_error = 0.05).precise_enough(tally)
+assert not monte_carlo.StoppingRule(ci_width = 1, method = 'normal').precise_enough({1: 5, 0: 5, -1: 0})
+assert monte_carlo.StoppingRule(num_deals = 50).batch_size(2, 20) == 10
+assert monte_carlo.StoppingRule(num_deals = 50).batch_size(3, 20) == 0
+
+# a run resumed from a checkpoint ends with the tally of an uninterrupted one
+(handle, checkpoint) = tempfile.mkstemp()
+os.close(handle)
+os.remove(checkpoint)
+try:
+  (half_tally, values) = monte_carlo.run_simulation(
+    monte_carlo.StoppingRule(num_deals = 60), 7, processes = 1, batch_size = 20,
+    checkpoint = checkpoint, verbose = False)
+  assert monte_carlo.load_checkpoint(checkpoint, 7, 20) == (3, half_tally, values)
+  try:
+    monte_carlo.load_checkpoint(checkpoint, 8, 20)
+    mismatch_loaded = True
+  except Exception:
+    mismatch_loaded = False
+  assert not mismatch_loaded
+  resumed = monte_carlo.run_simulation(rule, 7, processes = 1, batch_size = 20,
+                                       checkpoint = checkpoint, verbose = False)[0]
+  assert resumed == monte_carlo.run_simulation(rule, 7, processes = 1, batch_size = 20, verbose = False)[0]
+finally:
+  os.remove(checkpoint)
+
+# a run resumed from a checkpoint logs the deals of an uninterrupted run
+paths = []
+for i in range(3):
+  (handle, path) = tempfile.mkstemp()
+  os.close(handle)
+  os.remove(path)
+  paths.append(path)
+(checkpoint, resumed_log, straight_log) = paths
+try:
+  monte_carlo.run_simulation(monte_carlo.StoppingRule(num_deals = 60), 7, processes = 1,
+                             batch_size = 20, checkpoint = checkpoint, verbose = False,
+                             log_path = resumed_log)
+  assert deal_log.num_records(resumed_log) == 60
+  monte_carlo.run_simulation(rule, 7, processes = 1, batch_size = 20, checkpoint = checkpoint,
+                             verbose = False, log_path = resumed_log)
+  monte_carlo.run_simulation(rule, 7, processes = 1, batch_size = 20, verbose = False,
+                             log_path = straight_log)
+  without_times = lambda path: [record[:-1] for record in deal_log.iter_deals(path)]
+  assert len(without_times(resumed_log)) == 120
+  assert without_times(resumed_log) == without_times(straight_log)
+finally:
+  for path in paths:
+    if os.path.exists(path):
+      os.remove(path)
 
+# the simulator counts the hand evaluations behind the cells it evaluates
+stats = instrumentation.Stats()
+monte_carlo.run_simulation(monte_carlo.StoppingRule(num_deals = 20), 3, processes = 1,
+                           batch_size = 20, verbose = False, stats = stats)
+assert stats.counters['deals'] == 20 and stats.counters['cells evaluated'] > 0
+assert stats.counters['hand evaluations'] == game_simulator.hand_evaluations(
+  stats.counters['cells evaluated'], game_simulator.np is not None)
+assert game_simulator.hand_evaluations(10, False) == 20
@@ -0,0 +1,104 @@
+import collections
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+# a span is a named stretch of time.  every thread keeps its own stack of open
+# spans, so spans nest per thread however many threads or processes are
+# timing things, and a finished span is recorded with its parent's id into a
+# ring buffer holding the most recent max_spans.
+#
+# worker processes hand their spans back with drain(), and the parent adds
+# them with merge().  span ids carry the process id, so they stay unique
+# across processes, and spans opened in a parent before a worker was forked
+# can be the parents of the worker's spans.
+
+Span = collections.namedtuple('Span', 'id parent name pid tid start duration args')
+
+class Tracer(object):
+  def __init__(self, max_spans = 100000):
+    self.spans = collections.deque(maxlen = max_spans)
+    self.ids = itertools.count(1)
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.pid = os.getpid()
+
+  # the open spans of the calling thread, innermost last
+  def stack(self):
+    stack = getattr(self.local, 'stack', None)
+    if stack is None:
+      stack = self.local.stack = []
+    return stack
+
+  def depth(self):
+    return len(self.stack())
+
+  def new_id(self):
+    return (os.getpid() << 32) | next(self.ids)
+
+  # with tracer.span('name', key = value): records the block as a span
+  @contextlib.contextmanager
+  def span(self, name, **args):
+    stack = self.stack()
+    span_id = self.new_id()
+    parent = stack[-1] if stack else None
+    stack.append(span_id)
+    start = time.time()
+    try:
+      yield span_id
+    finally:
+      duration = time.time() - start
+      stack.pop()
+      self.record(Span(span_id, parent, name, os.getpid(), threading.current_thread().ident,
+                       start, duration, args))
+
+  def record(self, span):
+    with self.lock:
+      if self.pid != os.getpid():
+        # a forked child starts without its parent's spans
+        self.spans.clear()
+        self.pid = os.getpid()
+      self.spans.append(span)
+
+  # removes and returns the recorded spans, as plain tuples
+  def drain(self):
+    with self.lock:
+      if self.pid != os.getpid():
+        self.spans.clear()
+        self.pid = os.getpid()
+      spans = [tuple(span) for span in self.spans]
+      self.spans.clear()
+    return spans
+
+  # adds spans drained from another tracer
+  def merge(self, spans):
+    with self.lock:
+      self.spans.extend(Span(*span) for span in spans)
+
+  # the recorded spans as chrome trace events, for chrome://tracing or
+  # https://ui.perfetto.dev
+  def chrome_trace(self):
+    with self.lock:
+      spans = list(self.spans)
+    events = []
+    for span in spans:
+      args = dict(span.args)
+      args['id'] = span.id
+      if span.parent is not None:
+        args['parent'] = span.parent
+      events.append({'name': span.name, 'ph': 'X', 'pid': span.pid, 'tid': span.tid,
+                     'ts': span.start * 1e6, 'dur': span.duration * 1e6, 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  def save_chrome_trace(self, path):
+    with open(path, 'w') as f:
+      json.dump(self.chrome_trace(), f)
+
+# the tracer everything records into unless told otherwise
+TRACER = Tracer()
+
+def span(name, **args):
+  return TRACER.span(name, **args)